@@ -1,7 +1,13 @@
 from flask import Flask
+from markupsafe import Markup, escape
 from flask_login import LoginManager
+from sqlalchemy.exc import OperationalError
 from .config import Config
 from .db import DB
+from .cache_bus import CacheBus
+from .passwords import PasswordHasher, PasswordHasherBusy
+from .models.suggest import SuggestIndex
+from .models.inventory_hold import HoldSweeper
 import re
 
 
@@ -9,18 +15,37 @@ login = LoginManager()
 login.login_view = 'users.login'
 
 
-def highlight_search(text, query):
-    """Highlight search terms in text"""
+def highlight_search(text, query, terms=None):
+    """Highlight search terms in text.
+
+    terms are the stemmed lexemes Product.search matched on (e.g. 'batteri'
+    for "batteries"); when given, any word starting with one of them is
+    highlighted, so inflected forms light up too.  Without terms we fall back
+    to highlighting the literal query.  Matching runs on the raw text and
+    each piece is HTML-escaped as the result is rebuilt, so a term can never
+    match inside an entity such as &amp;.
+    """
     if not query or not text:
         return text
-    
-    # Escape special regex characters in query
-    escaped_query = re.escape(query)
-    # Create case-insensitive pattern
-    pattern = re.compile(f'({escaped_query})', re.IGNORECASE)
-    # Replace matches with highlighted version
-    highlighted = pattern.sub(r'<span class="search-highlight">\1</span>', text)
-    return highlighted
+
+    text = str(text)
+    if terms:
+        # snowball turns a trailing y into i ("battery" -> "batteri")
+        stems = [re.escape(t[:-1]) + '[iy]' if t.endswith('i') else re.escape(t)
+                 for t in sorted(terms, key=len, reverse=True)]
+        pattern = re.compile(r'\b((?:' + '|'.join(stems) + r')\w*)', re.IGNORECASE)
+    else:
+        # Escape special regex characters in query
+        escaped_query = re.escape(str(query))
+        # Create case-insensitive pattern
+        pattern = re.compile(f'({escaped_query})', re.IGNORECASE)
+    # split() with one capture group alternates plain text / match
+    parts = pattern.split(text)
+    highlighted = ''.join(
+        str(escape(part)) if i % 2 == 0
+        else '<span class="search-highlight">' + str(escape(part)) + '</span>'
+        for i, part in enumerate(parts))
+    return Markup(highlighted)
 
 
 def create_app():
@@ -28,7 +53,38 @@ def create_app():
     app.config.from_object(Config)
 
     app.db = DB(app)
+    app.suggest_index = SuggestIndex()
     login.init_app(app)
+
+    # writes publish on the bus; each process drops/reloads its own copies
+    from .models.product import Product
+    app.cache_bus = CacheBus(app)
+    app.cache_bus.subscribe('product', lambda product_id: Product.invalidate_cache())
+    app.cache_bus.subscribe('product', app.suggest_index.refresh)
+    app.cache_bus.subscribe('inventory', lambda inventory_id: Product.invalidate_cache())
+    app.cache_bus.subscribe('reviews', lambda product_id: Product.invalidate_cache())
+    from .models.user import user_cache
+    app.cache_bus.subscribe('users', user_cache.invalidate)
+    from .users import analytics_cache
+    app.cache_bus.subscribe('users', analytics_cache.invalidate)
+    app.cache_bus.subscribe('orders', analytics_cache.invalidate)
+    app.before_request(app.cache_bus.start)
+    with app.app_context():
+        try:
+            app.suggest_index.build()
+        except OperationalError:
+            # no database yet (e.g. a setup script); the first suggest() builds it
+            app.logger.warning('suggest index not built at startup', exc_info=True)
+
+    app.hold_sweeper = HoldSweeper(app)
+    app.before_request(app.hold_sweeper.start)
+
+    app.passwords = PasswordHasher(app)
+
+    @app.errorhandler(PasswordHasherBusy)
+    def password_hasher_busy(e):
+        # shed sign-in load rather than let it queue up behind the pool
+        return 'Too many sign-ins at the moment, please try again shortly.', 503, {'Retry-After': '5'}
     
     # Register custom Jinja2 filter
     app.jinja_env.filters['highlight_search'] = highlight_search
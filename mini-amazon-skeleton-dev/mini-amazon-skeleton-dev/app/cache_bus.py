@@ -0,0 +1,119 @@
+import json
+import os
+import select
+import threading
+import time
+import uuid
+
+
+class CacheBus:
+    """
+    Cache invalidation shared between worker processes via Postgres
+    LISTEN/NOTIFY.
+
+    Model write paths call publish(topic, key) for each write.  Handlers
+    registered for the topic with subscribe() run in this process once the
+    write has committed (see DB.after_commit), and when CACHE_BUS_ENABLED
+    is set the message also goes out on the CACHE_BUS_CHANNEL channel, which
+    Postgres delivers at the same commit.  Every other worker picks it up in
+    a background listener thread and runs its own handlers for it.
+
+    Topics in use: 'product' (key: product_id), 'inventory'
+    (inventory_id), 'reviews' (product_id), 'users' (user id) and 'orders'
+    (the buyer's user id).  A topic is added together with the cache that
+    subscribes to it.  A handler is called with the key, or with None when
+    this worker may have missed messages (listener reconnect) and should
+    drop everything for the topic.
+
+    One instance lives on the app (app.cache_bus).
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.enabled = app.config['CACHE_BUS_ENABLED']
+        self.channel = app.config['CACHE_BUS_CHANNEL']
+        # tags our own NOTIFYs so the listener can skip them
+        self.origin = uuid.uuid4().hex
+        self._handlers = {}
+        self._lock = threading.Lock()
+        self._listener_pid = None
+
+    def subscribe(self, topic, handler):
+        self._handlers.setdefault(topic, []).append(handler)
+
+    def publish(self, topic, key=None):
+        # inside a transaction the NOTIFY goes out when it commits; hold the
+        # local handlers back until then too, so a cache isn't refilled
+        # from rows that aren't committed yet (or never will be)
+        self.app.db.after_commit(self._dispatch, topic, key)
+        if self.enabled:
+            payload = json.dumps({"origin": self.origin, "topic": topic, "key": key})
+            self.app.db.execute("SELECT pg_notify(:channel, :payload)",
+                                channel=self.channel, payload=payload)
+
+    def start(self):
+        """Start the listener thread once per process (safe to call on every request)."""
+        if not self.enabled or self._listener_pid == os.getpid():
+            return
+        with self._lock:
+            if self._listener_pid == os.getpid():
+                return
+            # after a fork the parent's origin and thread don't carry over
+            self.origin = uuid.uuid4().hex
+            self._listener_pid = os.getpid()
+            threading.Thread(target=self._listen, name="cache-bus", daemon=True).start()
+
+    def _dispatch(self, topic, key):
+        for handler in self._handlers.get(topic, ()):
+            handler(key)
+
+    def _listen(self):
+        engine = self.app.db.engine
+        first = True
+        while True:
+            conn = None
+            try:
+                # a dedicated connection outside the pool; it is held for good
+                cargs, cparams = engine.dialect.create_connect_args(engine.url)
+                conn = engine.dialect.connect(*cargs, **cparams)
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(f'LISTEN "{self.channel}"')
+                if not first:
+                    # anything published while we were disconnected is lost
+                    with self.app.app_context():
+                        for topic in list(self._handlers):
+                            self._dispatch(topic, None)
+                first = False
+                if not hasattr(conn, 'poll'):
+                    # psycopg 3
+                    while True:
+                        for notify in conn.notifies(timeout=60):
+                            self._handle(notify.payload)
+                while True:
+                    if select.select([conn], [], [], 60) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        self._handle(conn.notifies.pop(0).payload)
+            except Exception:
+                self.app.logger.exception("cache bus listener failed; reconnecting")
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+                time.sleep(5)
+
+    def _handle(self, payload):
+        try:
+            message = json.loads(payload)
+        except ValueError:
+            return
+        if message.get("origin") == self.origin:
+            return
+        with self.app.app_context():
+            try:
+                self._dispatch(message["topic"], message.get("key"))
+            except Exception:
+                self.app.logger.exception("cache bus handler failed for %s", payload)
@@ -5,7 +5,7 @@ from flask import (
 )
 from flask_login import current_user, login_required
 
-from .models.cart import Cart
+from .models.cart import Cart, MAX_LINE_QUANTITY
 
 bp = Blueprint("cart", __name__)
 
@@ -18,25 +18,29 @@ def _resolve_inventory_id_for_product(product_id: int) -> int | None:
     """
     With your design (each product is a single seller listing),
     map product_id -> its lone inventory row.
-
-    NOTE: DB.execute takes only one SQL string; no params dict.
     """
-    rows = current_app.db.execute(f"""
+    rows = current_app.db.execute("""
         SELECT inventory_id
         FROM Inventory
-        WHERE product_id = {product_id}
+        WHERE product_id = :product_id
         ORDER BY inventory_id ASC
-    """)
+    """, product_id=product_id)
     return rows[0][0] if rows else None
 
+def _batch_quantity(value) -> int:
+    qty = int(value)
+    if qty > MAX_LINE_QUANTITY:
+        raise ValueError(f"quantity above {MAX_LINE_QUANTITY}")
+    return qty
+
 # --- routes ----------------------------------------------------------------
 
 @bp.route("/cart")
 @login_required
 def cart_page():
+    # one query once the cart_id is in the session
     cart_id = _ensure_cart_id(current_user.id)
-    items = Cart.get_items(cart_id)
-    subtotal, _ = Cart.totals(cart_id)
+    items, subtotal, _ = Cart.get_contents(cart_id)
     return render_template("cart.html", items=items, cart_total=subtotal)
 
 @bp.route("/cart/<int:user_id>")
@@ -47,6 +51,51 @@ def cart_api(user_id: int):
     cart_id = _ensure_cart_id(user_id)
     return jsonify(Cart.get_items(cart_id))
 
+@bp.route("/api/cart/batch", methods=["POST"])
+@login_required
+def cart_batch_api():
+    """
+    Apply a list of cart edits in one request and return the new cart:
+      {"operations": [{"op": "add", "product_id": 3, "quantity": 2},
+                      {"op": "add", "inventory_id": 7, "quantity": 1},
+                      {"op": "update", "cart_item_id": 12, "quantity": 4},
+                      {"op": "remove", "cart_item_id": 15}]}
+    -> {"items": [...], "subtotal": ..., "items_count": ...}
+    Quantities above MAX_LINE_QUANTITY are rejected with 400.
+    """
+    payload = request.get_json(silent=True) or {}
+    operations = payload.get("operations")
+    if not isinstance(operations, list):
+        return jsonify({"error": "expected {\"operations\": [...]}"}), 400
+
+    adds, updates, removes = [], [], []
+    try:
+        for op in operations:
+            kind = op.get("op")
+            if kind == "add":
+                qty = _batch_quantity(op.get("quantity", 1))
+                inventory_id = op.get("inventory_id")
+                product_id = op.get("product_id")
+                if inventory_id is None and product_id is None:
+                    raise ValueError("add needs inventory_id or product_id")
+                if qty > 0:
+                    adds.append((None if inventory_id is None else int(inventory_id),
+                                 None if product_id is None else int(product_id), qty))
+            elif kind == "update":
+                updates.append((int(op["cart_item_id"]), _batch_quantity(op["quantity"])))
+            elif kind == "remove":
+                removes.append(int(op["cart_item_id"]))
+            else:
+                raise ValueError(f"unknown op {kind!r}")
+    except (AttributeError, KeyError, TypeError, ValueError) as e:
+        return jsonify({"error": f"bad operation: {e}"}), 400
+
+    cart_id = _ensure_cart_id(current_user.id)
+    items, subtotal, items_count = Cart.apply_batch(cart_id, adds, updates, removes)
+    for it in items:
+        it["unit_price"] = float(it["unit_price"])
+    return jsonify({"items": items, "subtotal": subtotal, "items_count": items_count})
+
 @bp.route("/cart/add/<int:product_id>", methods=["POST"])
 @login_required
 def cart_add(product_id: int):
@@ -1,13 +1,19 @@
 # app/checkout.py
-from flask import Blueprint, render_template, redirect, url_for, current_app, request
+import uuid
+
+from flask import Blueprint, render_template, redirect, url_for, current_app, request, abort
 from flask_login import login_required, current_user
 from .models.cart import Cart
+from .models.order import Order
+from .models.user import User
+from .models.inventory_hold import HELD_BY_OTHERS, InventoryHold
 
 bp = Blueprint("checkout", __name__)
 
 def _validate_cart_for_checkout(cart_id: int):
     """
     Build a row per cart item using *current* inventory snapshot.
+    available_qty is stock minus what other buyers are holding.
     Always include current_price and available_qty even when not ok.
     Returns (validated_rows, subtotal_ok_items)
     """
@@ -19,15 +25,15 @@ def _validate_cart_for_checkout(cart_id: int):
           i.user_id                  AS seller_id,
           i.product_id,
           i.price                    AS current_price,
-          i.quantity                 AS available_qty,
+          i.quantity - {HELD_BY_OTHERS} AS available_qty,
           p.name                     AS product_name,
           p.image
         FROM CartItems ci
         JOIN Inventory i ON i.inventory_id = ci.inventory_id
         JOIN Products  p ON p.product_id = i.product_id
-        WHERE ci.cart_id = {cart_id}
+        WHERE ci.cart_id = :cart_id
         ORDER BY ci.cart_item_id
-    """)
+    """, cart_id=cart_id)
 
     validated = []
     subtotal = 0.0
@@ -69,51 +75,57 @@ def _validate_cart_for_checkout(cart_id: int):
 
     return validated, subtotal
 
+def _render_checkout(items, subtotal):
+    # a fresh key per rendered form: resubmitting this form is a replay,
+    # placing the order again later is a new order
+    # whether the balance covers the order is read fresh, not from the user cache
+    return render_template("checkout.html", items=items, subtotal=subtotal,
+                           balance=float(User.get_balance(current_user.id) or 0),
+                           idempotency_key=uuid.uuid4().hex)
+
 @bp.route("/checkout", methods=["GET"])
 @login_required
 def checkout_page():
     cart_id = Cart.ensure_for_user(current_user.id)
+    # set the stock aside while the buyer decides; a reload with the same
+    # cart keeps the holds it has without locking anything
+    InventoryHold.place(cart_id)
     validated, subtotal = _validate_cart_for_checkout(cart_id)
 
     # If any not-ok rows, send to a page that shows errors + “Fix in cart” link
     any_bad = any(not it["ok"] for it in validated)
     if any_bad:
-        return render_template("checkout.html", items=validated, subtotal=subtotal)
+        return _render_checkout(validated, subtotal)
 
     # Otherwise proceed to confirmation page
-    return render_template("checkout.html", items=validated, subtotal=subtotal)
+    return _render_checkout(validated, subtotal)
 
 @bp.route("/checkout/place", methods=["POST"])
 @login_required
 def checkout_place():
-    # (Your existing place-order code goes here; unchanged.)
-    # This route will assume the same validator and refuse if any item is invalid.
+    # The form carries an idempotency key (API clients can send an
+    # Idempotency-Key header); a repeated submit goes straight to its order.
+    key = (request.form.get("idempotency_key") or request.headers.get("Idempotency-Key") or "").strip() or None
+    if key is not None:
+        if len(key) > 64:
+            abort(400)
+        order_id = Order.find_by_idempotency_key(current_user.id, key)
+        if order_id is not None:
+            return redirect(url_for("orders.order_detail", order_id=order_id))
+
+    # Refuse if any item is invalid; Order.place checks stock again under row locks.
     cart_id = Cart.ensure_for_user(current_user.id)
     items, subtotal = _validate_cart_for_checkout(cart_id)
     if any(not it["ok"] for it in items):
-        return render_template("checkout.html", items=items, subtotal=subtotal)
-
-    # Example of the rest (use your existing logic if you already implemented it):
-    rows = current_app.db.execute(
-        f"INSERT INTO Orders(user_id, total_price, status) VALUES ({current_user.id}, {subtotal}, 'Pending') RETURNING order_id"
-    )
-    order_id = rows[0][0]
-
-    for it in items:
-        # double-check inventory snapshot
-        inv_rows = current_app.db.execute(f"SELECT price, quantity FROM Inventory WHERE inventory_id = {it['inventory_id']}")
-        price_now, qty_now = inv_rows[0]
-        qty_now = int(qty_now)
-        buy_qty = min(it["requested_qty"], qty_now)
-
-        current_app.db.execute(
-            f"""INSERT INTO OrderItems(order_id, inventory_id, quantity_required, final_unit_price, individual_fulfillment)
-                VALUES ({order_id}, {it['inventory_id']}, {buy_qty}, {float(price_now)}, 'Not Yet Fulfilled')"""
-        )
-        current_app.db.execute(
-            f"UPDATE Inventory SET quantity = {qty_now - buy_qty} WHERE inventory_id = {it['inventory_id']}"
-        )
+        return _render_checkout(items, subtotal)
 
-    # clear cart and redirect to order detail
-    current_app.db.execute(f"DELETE FROM CartItems WHERE cart_id = {cart_id}")
-    return redirect(url_for("orders.order_detail", order_id=order_id))
\ No newline at end of file
+    if current_app.config["CHECKOUT_ASYNC"]:
+        # queued for order_worker.py; the order page shows it as 'Queued' until then
+        order_id = Order.enqueue(current_user.id, cart_id, idempotency_key=key)
+    else:
+        order_id = Order.place(current_user.id, cart_id, idempotency_key=key)
+    if order_id is None:
+        # stock or the cart changed since it was validated; show the current state
+        items, subtotal = _validate_cart_for_checkout(cart_id)
+        return _render_checkout(items, subtotal)
+    return redirect(url_for("orders.order_detail", order_id=order_id))
@@ -4,10 +4,80 @@ from urllib.parse import quote_plus
 
 class Config(object):
     SECRET_KEY = os.environ.get('SECRET_KEY')
-    SQLALCHEMY_DATABASE_URI = 'postgresql://{}:{}@{}:{}/{}'\
-        .format(os.environ.get('DB_USER'),
+    # DB_DRIVER=postgresql+psycopg selects psycopg 3 (poetry install -E psycopg),
+    # which can use server-side prepared statements (see DB_PREPARE_THRESHOLD)
+    SQLALCHEMY_DATABASE_URI = '{}://{}:{}@{}:{}/{}'\
+        .format(os.environ.get('DB_DRIVER', 'postgresql'),
+                os.environ.get('DB_USER'),
                 quote_plus(os.environ.get('DB_PASSWORD')),
                 os.environ.get('DB_HOST'),
                 os.environ.get('DB_PORT'),
                 os.environ.get('DB_NAME'))
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # pg_trgm word-similarity cutoff (0..1) for typo-tolerant product search
+    SEARCH_SIMILARITY_THRESHOLD = float(os.environ.get('SEARCH_SIMILARITY_THRESHOLD', 0.5))
+    # in-process catalog cache (app/models/product.py): seconds before cached
+    # browse/search data is refetched even without a write; 0 disables it
+    CATALOG_CACHE_TTL = int(os.environ.get('CATALOG_CACHE_TTL', 60))
+    # max entries (sorted id lists, detail rows, search results) kept in its LRU
+    CATALOG_CACHE_SIZE = int(os.environ.get('CATALOG_CACHE_SIZE', 256))
+    # broadcast cache invalidations to the other workers over Postgres
+    # LISTEN/NOTIFY (app/cache_bus.py); turn on when running more than one process
+    CACHE_BUS_ENABLED = os.environ.get('CACHE_BUS_ENABLED', '0').lower() in ('1', 'true', 'yes')
+    CACHE_BUS_CHANNEL = os.environ.get('CACHE_BUS_CHANNEL', 'cache_invalidation')
+    # login.user_loader cache (app/models/user.py): seconds a Users row is
+    # reused for current_user without a query; 0 disables it.  With more than
+    # one process, changes from the others only show up early if
+    # CACHE_BUS_ENABLED is set, otherwise after this many seconds
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 30))
+    USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 1024))
+    # per-user /api/analytics results, dropped when the user orders or their
+    # balance changes; 0 disables
+    ANALYTICS_CACHE_TTL = int(os.environ.get('ANALYTICS_CACHE_TTL', 300))
+    ANALYTICS_CACHE_SIZE = int(os.environ.get('ANALYTICS_CACHE_SIZE', 512))
+    # threads (so pooled connections) the analytics queries of all requests in
+    # a process may use at once; keep it well below DB_POOL_SIZE
+    ANALYTICS_WORKERS = int(os.environ.get('ANALYTICS_WORKERS', 2))
+    # SQLAlchemy connection pool (per worker process)
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+    DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 30))
+    # seconds before a pooled connection is replaced; keep below any server/proxy idle timeout
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+    DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', '1').lower() in ('1', 'true', 'yes')
+    # retries for transactions that fail with a serialization error or
+    # deadlock (app.db.DB); the backoff doubles from BASE up to MAX seconds, with jitter
+    DB_RETRY_MAX_ATTEMPTS = int(os.environ.get('DB_RETRY_MAX_ATTEMPTS', 5))
+    DB_RETRY_BASE_DELAY = float(os.environ.get('DB_RETRY_BASE_DELAY', 0.01))
+    DB_RETRY_MAX_DELAY = float(os.environ.get('DB_RETRY_MAX_DELAY', 0.5))
+    # optional read replicas (comma-separated URIs); reads marked read_only /
+    # read_committed (app.db) are spread over them, with the primary as fallback
+    SQLALCHEMY_REPLICA_URIS = [uri.strip() for uri in os.environ.get('DB_REPLICA_URIS', '').split(',') if uri.strip()]
+    # how long an unreachable replica is skipped before it is probed again
+    DB_REPLICA_DOWN_SECONDS = int(os.environ.get('DB_REPLICA_DOWN_SECONDS', 30))
+    # after a write, that session's reads stay on the primary this long
+    DB_READ_YOUR_WRITES_SECONDS = int(os.environ.get('DB_READ_YOUR_WRITES_SECONDS', 5))
+    # psycopg 3 only: executions of the same statement on a connection before
+    # it is prepared server-side (0 = prepare immediately)
+    DB_PREPARE_THRESHOLD = int(os.environ.get('DB_PREPARE_THRESHOLD', 2))
+    # checkout holds stock for a buyer this long (app/models/inventory_hold.py)
+    INVENTORY_HOLD_SECONDS = int(os.environ.get('INVENTORY_HOLD_SECONDS', 600))
+    # how often each worker deletes expired holds; 0 turns the sweeper off
+    INVENTORY_HOLD_SWEEP_SECONDS = int(os.environ.get('INVENTORY_HOLD_SWEEP_SECONDS', 60))
+    # place orders in the background: /checkout/place queues an OrderJobs row
+    # and order_worker.py processes drain the queue
+    CHECKOUT_ASYNC = os.environ.get('CHECKOUT_ASYNC', '').lower() in ('1', 'true', 'yes', 'on')
+    # jobs each worker claims per transaction, and its sleep when the queue is empty
+    ORDER_WORKER_BATCH_SIZE = int(os.environ.get('ORDER_WORKER_BATCH_SIZE', 10))
+    ORDER_WORKER_POLL_SECONDS = float(os.environ.get('ORDER_WORKER_POLL_SECONDS', 1))
+    # a queued order whose processing raises this many times is marked Failed
+    ORDER_JOB_MAX_ATTEMPTS = int(os.environ.get('ORDER_JOB_MAX_ATTEMPTS', 3))
+    # password hashing (app/passwords.py): werkzeug method for new hashes, with
+    # every parameter given; logins upgrade hashes made with anything else
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:600000')
+    # hashing processes per web worker (0 = hash on the request thread), how
+    # many hash/verify calls may run or wait for them, and how long a call
+    # waits for a slot before the request gets a 503
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+    PASSWORD_HASH_QUEUE = int(os.environ.get('PASSWORD_HASH_QUEUE', 8))
+    PASSWORD_HASH_WAIT_SECONDS = float(os.environ.get('PASSWORD_HASH_WAIT_SECONDS', 5))
@@ -1,4 +1,83 @@
-from sqlalchemy import create_engine, text
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+import random
+import re
+import threading
+import time
+
+from flask import current_app, g, has_app_context, has_request_context, session
+from sqlalchemy import create_engine, make_url, text
+from sqlalchemy.exc import DBAPIError, OperationalError
+
+
+# serialization_failure and deadlock_detected: the transaction did nothing
+# wrong and will usually succeed if simply run again
+RETRYABLE_SQLSTATES = {'40001', '40P01'}
+
+
+# isolation modes a unit of work can ask for (see the isolation decorator):
+#   serializable    the default; for anything that writes (checkout, balance)
+#   read_only       SERIALIZABLE READ ONLY DEFERRABLE: a consistent snapshot
+#                   that takes no predicate locks and never aborts
+#   read_committed  cheapest; fine for reads that are a single statement
+ISOLATION_MODES = ('serializable', 'read_only', 'read_committed')
+
+_isolation = ContextVar('db_isolation', default='serializable')
+
+# admin_shutdown, crash_shutdown, cannot_connect_now: the server is going
+# away or not up yet (class 08, connection_exception, is matched by prefix)
+SERVER_DOWN_SQLSTATES = {'57P01', '57P02', '57P03'}
+
+# statements that make a session stick to the primary for a while: ones
+# that start with a write, or a WITH whose CTEs or main statement write
+# (a locking SELECT ... FOR UPDATE doesn't count)
+_WRITE_STATEMENT = re.compile(
+    r'^\s*(?:INSERT|UPDATE|DELETE)\b|^\s*WITH\b.*?[()]\s*(?:INSERT|UPDATE|DELETE)\b',
+    re.IGNORECASE | re.DOTALL)
+
+
+def _sqlstate(exc):
+    orig = getattr(exc, 'orig', None)
+    return getattr(orig, 'pgcode', None) or getattr(orig, 'sqlstate', None)
+
+
+def is_retryable(exc):
+    """True for a DBAPIError caused by a serialization failure or deadlock."""
+    return isinstance(exc, DBAPIError) and _sqlstate(exc) in RETRYABLE_SQLSTATES
+
+
+def is_connection_failure(exc):
+    """
+    True for a DBAPIError that means the server can't be used right now:
+    the connection was lost, couldn't be made (no SQLSTATE, the server
+    never answered), or the server is shutting down or starting up.
+    Errors from a statement that did reach it, like a query cancel or a
+    recovery conflict on a standby, don't count.
+    """
+    if not isinstance(exc, DBAPIError):
+        return False
+    if exc.connection_invalidated:
+        return True
+    sqlstate = _sqlstate(exc)
+    return sqlstate is None or sqlstate.startswith('08') or sqlstate in SERVER_DOWN_SQLSTATES
+
+
+class _Replica:
+    """One read replica: an engine per read mode, plus its health state."""
+    __slots__ = ("name", "engines", "down_until")
+
+    def __init__(self, uri, engine_args):
+        # a hot standby can't run SERIALIZABLE; REPEATABLE READ gives the
+        # same single-snapshot guarantee for read-only transactions there
+        base = create_engine(uri, isolation_level="REPEATABLE READ", **engine_args)
+        self.name = base.url.render_as_string(hide_password=True)
+        self.engines = {
+            'read_only': base.execution_options(postgresql_readonly=True),
+            'read_committed': base.execution_options(isolation_level="READ COMMITTED",
+                                                     postgresql_readonly=True),
+        }
+        self.down_until = 0.0
 
 
 class DB:
@@ -17,10 +96,213 @@ class DB:
     >>>     conn.execute(text('UPDATE...'), par=value)
     >>>
 
+    Under SERIALIZABLE a transaction can fail with a serialization error
+    just because a concurrent one touched the same rows.  execute() retries
+    its own one-statement transactions on those; for several statements
+    use the @transactional decorator, which reruns the whole function:
+
+    >>> @transactional
+    >>> def move_stock(src, dst, qty):
+    >>>     app.db.execute('UPDATE ...', ...)   # both run in one transaction
+    >>>     app.db.execute('UPDATE ...', ...)
+
+    Reads can declare weaker isolation so they don't pay for SERIALIZABLE:
+
+    >>> @staticmethod
+    >>> @read_committed
+    >>> def get_categories(): ...
+
+    With SQLALCHEMY_REPLICA_URIS set, execute() calls in read_only or
+    read_committed mode go to the replicas round-robin (see _run_alone);
+    everything else, and every read from a session that wrote within the
+    last DB_READ_YOUR_WRITES_SECONDS, stays on the primary.
+
+    A view can also opt in to one connection for the whole request with
+    the @request_connection decorator (or use_request_connection()); every
+    execute() in that request then runs on it, in one transaction that is
+    committed when the view returns.
+
     """
     def __init__(self, app):
-        self.engine = create_engine(app.config['SQLALCHEMY_DATABASE_URI'],
-                                    execution_options={"isolation_level": "SERIALIZABLE"})
+        uri = app.config['SQLALCHEMY_DATABASE_URI']
+        engine_args = dict(pool_size=app.config['DB_POOL_SIZE'],
+                           max_overflow=app.config['DB_MAX_OVERFLOW'],
+                           pool_timeout=app.config['DB_POOL_TIMEOUT'],
+                           pool_recycle=app.config['DB_POOL_RECYCLE'],
+                           pool_pre_ping=app.config['DB_POOL_PRE_PING'])
+        if make_url(uri).get_driver_name() == 'psycopg':
+            # psycopg 3 prepares a statement server-side once it has run this
+            # many times on a connection, so bound-parameter SQL is parsed
+            # and planned once per connection instead of on every call
+            # (psycopg2 has no server-side prepared statements)
+            engine_args['connect_args'] = {'prepare_threshold': app.config['DB_PREPARE_THRESHOLD']}
+        self.engine = create_engine(uri, isolation_level="SERIALIZABLE", **engine_args)
+        # same pool, different per-transaction settings
+        self._engines = {
+            'serializable': self.engine,
+            'read_only': self.engine.execution_options(isolation_level="SERIALIZABLE",
+                                                       postgresql_readonly=True,
+                                                       postgresql_deferrable=True),
+            'read_committed': self.engine.execution_options(isolation_level="READ COMMITTED"),
+        }
+        self.replicas = [_Replica(uri, engine_args) for uri in app.config['SQLALCHEMY_REPLICA_URIS']]
+        self._replica_lock = threading.Lock()
+        self._next_replica = 0
+        self.replica_down_seconds = app.config['DB_REPLICA_DOWN_SECONDS']
+        self.read_your_writes_seconds = app.config['DB_READ_YOUR_WRITES_SECONDS']
+        self.retry_max_attempts = app.config['DB_RETRY_MAX_ATTEMPTS']
+        self.retry_base_delay = app.config['DB_RETRY_BASE_DELAY']
+        self.retry_max_delay = app.config['DB_RETRY_MAX_DELAY']
+        # counters for monitoring; read with retry_metrics(), served at /api/metrics/db
+        self._retry_lock = threading.Lock()
+        self._retry_counts = {'transactions': 0, 'retried': 0, 'retries': 0, 'gave_up': 0}
+        self._logger = app.logger
+        app.teardown_appcontext(self.release_request_connection)
+
+    @contextmanager
+    def transaction(self):
+        """
+        Run a block in one transaction: execute() calls inside it share its
+        connection.  Nested inside another transaction (or a request
+        connection) it joins the outer one.  Does not retry; see
+        run_in_transaction / @transactional for that.
+
+        Callbacks registered with after_commit() inside the block run once
+        it has committed, and are dropped if it rolls back.
+        """
+        outer = self._current_connection()
+        if outer is not None:
+            yield outer
+            return
+        callbacks = []
+        with self._engine_for_mode().begin() as conn:
+            g.db_uow = conn
+            g.db_after_commit = callbacks
+            try:
+                yield conn
+            finally:
+                g.pop('db_uow', None)
+                g.pop('db_after_commit', None)
+        self._run_callbacks(callbacks)
+
+    @contextmanager
+    def savepoint(self):
+        """
+        Inside transaction(): run a block under a SAVEPOINT, so an exception
+        undoes only the block's statements (and its after_commit callbacks)
+        and the transaction can carry on.  Don't use it to swallow a
+        serialization failure; the whole transaction has to be retried then.
+        """
+        conn = self._current_connection()
+        callbacks = g.db_after_commit
+        queued = len(callbacks)
+        try:
+            with conn.begin_nested():
+                yield conn
+        except BaseException:
+            del callbacks[queued:]
+            raise
+
+    def after_commit(self, fn, *args):
+        """
+        Call fn(*args) once the current transaction (or request connection)
+        commits, or right away outside one.  A transaction that is rolled
+        back, e.g. to be retried, never runs its callbacks.
+        """
+        if self._current_connection() is None:
+            fn(*args)
+        else:
+            g.db_after_commit.append((fn, args))
+
+    @staticmethod
+    def _run_callbacks(callbacks):
+        for fn, args in callbacks:
+            fn(*args)
+
+    def run_in_transaction(self, fn, *args, **kwargs):
+        """
+        Call fn(*args, **kwargs) inside transaction() and commit, rerunning
+        it from the start (with jittered exponential backoff) when the
+        transaction hits a serialization failure or deadlock, up to
+        DB_RETRY_MAX_ATTEMPTS times.  fn must be safe to run again, i.e. not
+        have side effects outside the database.
+        """
+        if self._current_connection() is not None:
+            # part of a bigger transaction; only the outermost one can retry
+            return fn(*args, **kwargs)
+        return self._with_retries(self._call_in_transaction, fn, args, kwargs)
+
+    def _call_in_transaction(self, fn, args, kwargs):
+        with self.transaction():
+            return fn(*args, **kwargs)
+
+    def _with_retries(self, attempt_fn, *args):
+        attempt = 1
+        while True:
+            try:
+                result = attempt_fn(*args)
+            except DBAPIError as exc:
+                if not is_retryable(exc):
+                    raise
+                if attempt >= self.retry_max_attempts:
+                    self._count_retries(attempt, gave_up=True)
+                    self._logger.warning('giving up after %d attempts: %s', attempt, exc.orig)
+                    raise
+                delay = min(self.retry_max_delay, self.retry_base_delay * 2 ** (attempt - 1))
+                self._logger.info('retrying transaction (attempt %d) after %s', attempt + 1, exc.orig.__class__.__name__)
+                time.sleep(random.uniform(0, delay))
+                attempt += 1
+                continue
+            self._count_retries(attempt)
+            return result
+
+    def _count_retries(self, attempts, gave_up=False):
+        with self._retry_lock:
+            self._retry_counts['transactions'] += 1
+            if attempts > 1:
+                self._retry_counts['retried'] += 1
+                self._retry_counts['retries'] += attempts - 1
+            if gave_up:
+                self._retry_counts['gave_up'] += 1
+
+    def retry_metrics(self):
+        """Counters since startup: transactions run, how many needed retries,
+        total retries, and how many still failed after the last attempt."""
+        with self._retry_lock:
+            return dict(self._retry_counts)
+
+    def _current_connection(self):
+        if not has_app_context():
+            return None
+        return g.get('db_uow') or g.get('db_conn')
+
+    def use_request_connection(self):
+        """Check out one connection for the rest of this request and begin its transaction."""
+        if 'db_conn' not in g:
+            g.db_conn = self._engine_for_mode().connect()
+            g.db_txn = g.db_conn.begin()
+            g.db_after_commit = []
+        return g.db_conn
+
+    def commit_request_connection(self):
+        txn = g.get('db_txn')
+        if txn is not None and txn.is_active:
+            txn.commit()
+            callbacks, g.db_after_commit = g.db_after_commit, []
+            self._run_callbacks(callbacks)
+
+    def release_request_connection(self, exc=None):
+        """teardown_appcontext hook: roll back anything uncommitted and return the connection."""
+        conn = g.pop('db_conn', None)
+        txn = g.pop('db_txn', None)
+        g.pop('db_after_commit', None)
+        if conn is None:
+            return
+        try:
+            if txn.is_active:
+                txn.rollback()
+        finally:
+            conn.close()
 
     def execute(self, sqlstr, **kwargs):
         """Execute a single SQL statement sqlstr.
@@ -37,10 +319,145 @@ class DB:
         https://docs.sqlalchemy.org/en/14/core/connections.html#sqlalchemy.engine.CursorResult
         for additional details.  See models/*.py for examples of
         calling this function.
+        Inside transaction()/@transactional, or if the request holds a
+        connection (see use_request_connection), the statement runs in that
+        transaction; otherwise in its own, which is retried on
+        serialization failures and uses the isolation mode of the innermost
+        @isolation-decorated caller (SERIALIZABLE if none).
         """
-        with self.engine.begin() as conn:
-            result = conn.execute(text(sqlstr), kwargs)
-            if result.returns_rows:
-                return result.fetchall()
-            else:
-                return result.rowcount
+        conn = self._current_connection()
+        if conn is not None:
+            return self._run(conn, sqlstr, kwargs)
+        return self._with_retries(self._run_alone, sqlstr, kwargs)
+
+    def _engine_for_mode(self):
+        return self._engines[_isolation.get()]
+
+    def _run_alone(self, sqlstr, params):
+        mode = _isolation.get()
+        if mode != 'serializable' and self.replicas and not self._sticky():
+            replica = self._pick_replica()
+            if replica is not None:
+                try:
+                    with replica.engines[mode].begin() as conn:
+                        return self._run(conn, sqlstr, params)
+                except OperationalError as exc:
+                    if not is_connection_failure(exc):
+                        # the replica answered; a recovery conflict is
+                        # retried by _with_retries, anything else is ours
+                        raise
+                    # can't reach it (or it's shutting down): take it out of
+                    # rotation and answer from the primary
+                    self._mark_down(replica, exc)
+        with self._engines[mode].begin() as conn:
+            return self._run(conn, sqlstr, params)
+
+    def _pick_replica(self):
+        """Next healthy replica round-robin, or None if they are all down."""
+        now = time.monotonic()
+        with self._replica_lock:
+            n = len(self.replicas)
+            start = self._next_replica
+            self._next_replica = (start + 1) % n
+        for i in range(n):
+            replica = self.replicas[(start + i) % n]
+            if replica.down_until == 0.0:
+                return replica
+            if replica.down_until <= now and self._probe(replica):
+                return replica
+        return None
+
+    def _probe(self, replica):
+        """Health check for a replica that was marked down; True if it answers again."""
+        try:
+            with replica.engines['read_committed'].connect() as conn:
+                conn.execute(text("SELECT 1"))
+        except OperationalError as exc:
+            if is_connection_failure(exc):
+                self._mark_down(replica, exc)
+                return False
+            # it answered, so it is reachable again
+        replica.down_until = 0.0
+        self._logger.info('replica %s is back', replica.name)
+        return True
+
+    def _mark_down(self, replica, exc):
+        replica.down_until = time.monotonic() + self.replica_down_seconds
+        self._logger.warning('replica %s marked down for %ss: %s',
+                             replica.name, self.replica_down_seconds, exc.orig)
+
+    def _sticky(self):
+        """Whether this session wrote recently enough that replicas may not have caught up."""
+        if not has_request_context():
+            return False
+        if g.get('db_wrote'):
+            return True
+        return time.time() - session.get('db_last_write', 0) < self.read_your_writes_seconds
+
+    def _note_write(self):
+        if self.replicas and has_request_context():
+            g.db_wrote = True
+            session['db_last_write'] = time.time()
+
+    def _run(self, conn, sqlstr, params):
+        result = conn.execute(text(sqlstr), params)
+        if _WRITE_STATEMENT.search(sqlstr):
+            self._note_write()
+        if result.returns_rows:
+            return result.fetchall()
+        else:
+            return result.rowcount
+
+
+def request_connection(view):
+    """
+    View decorator: run all of the view's app.db.execute() calls on one
+    pooled connection in one transaction, committed once the view returns
+    (rolled back if it raises).  Meant for pages that issue several
+    independent queries; views that need a transaction of their own should
+    keep using engine.begin().
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        current_app.db.use_request_connection()
+        rv = view(*args, **kwargs)
+        current_app.db.commit_request_connection()
+        return rv
+    return wrapper
+
+
+def transactional(fn):
+    """
+    Decorator: run fn as one unit of work via app.db.run_in_transaction,
+    retried as a whole on serialization failures and deadlocks.
+    """
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        return current_app.db.run_in_transaction(fn, *args, **kwargs)
+    return wrapper
+
+
+def isolation(mode):
+    """
+    Decorator: new transactions started while fn runs (execute(),
+    transaction(), request connections) use the given ISOLATION_MODES
+    mode.  Has no effect on a transaction that is already open.
+    """
+    if mode not in ISOLATION_MODES:
+        raise ValueError(f"unknown isolation mode {mode!r}")
+
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            token = _isolation.set(mode)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _isolation.reset(token)
+        return wrapper
+    return decorator
+
+
+serializable = isolation('serializable')
+read_only = isolation('read_only')
+read_committed = isolation('read_committed')
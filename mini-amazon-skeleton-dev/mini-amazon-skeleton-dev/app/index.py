@@ -1,8 +1,9 @@
-from flask import render_template, request, redirect, url_for, jsonify
+from flask import render_template, request, redirect, url_for, jsonify, current_app
 from flask_login import current_user
 import datetime
+import os
 
-from .models.product import Product
+from .models.product import Product, PAGE_SIZE
 from .models.purchase import Purchase
 
 from flask import Blueprint
@@ -14,8 +15,21 @@ def index():
     # get all available products for sale:
     sort = request.args.get('sort', default='name_asc')
     category = request.args.get('category', default='all')
-    products = Product.get_all(True, sort=sort, category=category)
-    categories = ['all'] + Product.get_categories()
+    price_bucket = request.args.get('price', type=int)
+    page = Product.get_page(True, sort=sort, category=category,
+                            cursor=request.args.get('cursor'),
+                            direction=request.args.get('direction', default='next'),
+                            limit=request.args.get('limit', default=PAGE_SIZE, type=int),
+                            price_bucket=price_bucket, with_facets=True)
+    products = page['products']
+    # categories come from the facet counts, so no separate SELECT DISTINCT
+    facets = page['facets']
+    # the counts honour the price filter; keep the selected category listed
+    # (at 0) so the dropdown still shows it and the next submit keeps it
+    category_counts = dict(facets['categories'])
+    if category != 'all':
+        category_counts.setdefault(category, 0)
+    categories = sorted(category_counts)
 
     # find the products current user has bought:
     if current_user.is_authenticated:
@@ -37,8 +51,14 @@ def index():
         purchase_history=purchases,
         current_sort=sort,
         current_category=category,
+        current_price=price_bucket,
         categories=categories,
-        wishlist_product_ids=wishlist_product_ids
+        category_counts=category_counts,
+        facets=facets,
+        wishlist_product_ids=wishlist_product_ids,
+        next_cursor=page['next_cursor'],
+        prev_cursor=page['prev_cursor'],
+        page_limit=page['limit']
     )
 
 
@@ -46,13 +66,21 @@ def index():
 def api_products():
     """
     Backend API endpoint for sorting products with SQL execution.
-    Returns JSON data for frontend consumption.
+    Returns JSON data for frontend consumption, one keyset page at a time:
+    pass next_cursor (or prev_cursor with direction=prev) back as ?cursor=.
     """
     # Extract parameters from query string
     sort = request.args.get('sort', default='name_asc')
     category = request.args.get('category', default='all')
+    price_bucket = request.args.get('price', type=int)
+    with_facets = request.args.get('facets', default=0, type=int) == 1
     
-    products = Product.get_all(True, sort=sort, category=category)
+    page = Product.get_page(True, sort=sort, category=category,
+                            cursor=request.args.get('cursor'),
+                            direction=request.args.get('direction', default='next'),
+                            limit=request.args.get('limit', default=PAGE_SIZE, type=int),
+                            price_bucket=price_bucket, with_facets=with_facets)
+    products = page['products']
     
     # Convert to JSON format
     products_json = []
@@ -71,14 +99,49 @@ def api_products():
             'available': product.available
         })
     
-    return jsonify({
+    response = {
         'products': products_json,
         'total_count': len(products_json),
         'sort_applied': sort,
-        'category_filter': category
+        'category_filter': category,
+        'price_filter': price_bucket,
+        'limit': page['limit'],
+        'next_cursor': page['next_cursor'],
+        'prev_cursor': page['prev_cursor']
+    }
+    if with_facets:
+        response['facets'] = page['facets']
+    return jsonify(response)
+
+
+@bp.route('/api/search/suggest')
+def api_search_suggest():
+    """
+    Search-as-you-type: product names and categories starting with ?q=.
+    Served from the in-process prefix index, never from the database.
+    """
+    query = request.args.get('q', default='')
+    limit = max(1, min(request.args.get('limit', default=8, type=int), 20))
+    suggestions = current_app.suggest_index.suggest(query, limit=limit)
+    return jsonify({
+        'query': query,
+        'products': suggestions['products'],
+        'categories': suggestions['categories']
     })
 
 
+@bp.route('/api/metrics/db')
+def api_db_metrics():
+    """
+    Transaction retry counters of this worker process (DB.retry_metrics):
+    transactions run, how many needed retries, total retries and how many
+    gave up.  Each process counts its own; scrape every worker to sum them.
+    """
+    metrics = current_app.db.retry_metrics()
+    metrics['pid'] = os.getpid()
+    return jsonify(metrics)
+
+
 @bp.route('/product/<int:product_id>')
 def product_detail(product_id):
     """Show detailed product page with reviews and a single 'Add to Cart' target."""
@@ -129,15 +192,27 @@ def product_detail(product_id):
 
 @bp.route('/search')
 def search():
-    """Search products by name and description"""
+    """Search products by name, category and description"""
     query = request.args.get('q', '').strip()
 
     if not query:
         # If no search query, redirect to browse products
         return redirect(url_for('index.index'))
 
-    # Search products by name and description
-    products = Product.search(query)
+    # Full-text search over name, category and description
+    sort = request.args.get('sort', default='relevance')
+    page = request.args.get('page', default=1, type=int)
+    fuzzy = request.args.get('fuzzy', default=0, type=int) == 1
+    results = Product.search(query, sort=sort, page=page, fuzzy=fuzzy)
+
+    # No exact hits: offer a "did you mean" and fall back to typo-tolerant matches
+    suggestion = None
+    if not results['products'] and not fuzzy and page == 1:
+        suggestion = Product.suggest_spelling(query)
+        if suggestion:
+            fuzzy = True
+            results = Product.search(query, sort=sort, page=page, fuzzy=True)
+    products = results['products']
     categories = ['all'] + Product.get_categories()
 
     # get wishlist items for current user
@@ -151,6 +226,12 @@ def search():
         'search_results.html',
         products=products,
         query=query,
+        terms=results['terms'],
+        fuzzy=fuzzy,
+        suggestion=suggestion,
+        current_sort=sort,
+        page=results['page'],
+        has_next=results['has_next'],
         categories=categories,
         wishlist_product_ids=wishlist_product_ids
     )
\ No newline at end of file
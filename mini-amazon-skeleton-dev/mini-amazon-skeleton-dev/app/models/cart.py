@@ -1,34 +1,44 @@
 # app/models/cart.py
-from flask import current_app
+from flask import current_app, has_request_context, session
+
+from ..db import transactional
+
+# most of one listing a cart line may ask for (keeps sums well inside INT)
+MAX_LINE_QUANTITY = 10_000
 
 class Cart:
     @staticmethod
     def ensure_for_user(user_id: int) -> int:
-        """Return existing cart_id for user or create one."""
-        rows = current_app.db.execute(f"""
-            SELECT cart_id
-            FROM Carts
-            WHERE user_id = {user_id}
-        """)
-        if rows:
-            # DB returns tuples; first column is cart_id
-            return rows[0][0]
+        """
+        Return existing cart_id for user or create one.  Inside a request
+        the answer is kept in the session as (user_id, cart_id), so after
+        the first lookup this costs no query (a user's cart never changes).
+        """
+        cached = session.get("cart_id") if has_request_context() else None
+        if cached and cached[0] == user_id:
+            return cached[1]
 
-        # Create and return the new cart id
-        rows = current_app.db.execute(f"""
+        # one statement whether or not the cart exists yet: the no-op
+        # DO UPDATE makes RETURNING give back the existing row as well
+        rows = current_app.db.execute("""
             INSERT INTO Carts(user_id)
-            VALUES ({user_id})
+            VALUES (:user_id)
+            ON CONFLICT (user_id) DO UPDATE SET user_id = EXCLUDED.user_id
             RETURNING cart_id
-        """)
-        return rows[0][0]
+        """, user_id=user_id)
+        cart_id = rows[0][0]
+        if has_request_context():
+            session["cart_id"] = (user_id, cart_id)
+        return cart_id
 
     @staticmethod
-    def get_items(cart_id: int):
+    def get_contents(cart_id: int):
         """
-        Return cart items with joined product + seller + price info.
-        Each row comes back as a tuple; map to dicts for templates/JSON.
+        Cart items (as get_items) plus subtotal and total item count at
+        current inventory prices, in one query: the totals ride along on
+        every row as window aggregates.  Returns (items, subtotal, items_count).
         """
-        rows = current_app.db.execute(f"""
+        rows = current_app.db.execute("""
             SELECT
                 ci.cart_item_id,                 -- 0
                 ci.quantity_required,            -- 1
@@ -38,85 +48,178 @@ class Cart:
                 p.product_id,                    -- 5
                 p.name         AS product_name,  -- 6
                 p.image,                         -- 7
-                p.category                        -- 8
+                p.category,                      -- 8
+                SUM(ci.quantity_required * i.price) OVER () AS subtotal,     -- 9
+                SUM(ci.quantity_required) OVER ()           AS items_count   -- 10
             FROM CartItems ci
             JOIN Inventory i ON ci.inventory_id = i.inventory_id
             JOIN Products  p ON i.product_id   = p.product_id
-            WHERE ci.cart_id = {cart_id}
+            WHERE ci.cart_id = :cart_id
             ORDER BY ci.cart_item_id DESC
-        """)
+        """, cart_id=cart_id)
         cols = [
             "cart_item_id", "quantity_required", "inventory_id", "unit_price",
             "seller_id", "product_id", "product_name", "image", "category"
         ]
-        return [dict(zip(cols, r)) for r in rows]
+        items = [dict(zip(cols, r)) for r in rows]
+        if not rows:
+            return items, 0.0, 0
+        return items, float(rows[0][9]), int(rows[0][10])
 
     @staticmethod
-    def add_item(cart_id: int, inventory_id: int, qty: int):
-        """Add or bump quantity for same inventory_id in this cart."""
-        # Check if an item already exists for this inventory in the cart
-        rows = current_app.db.execute(f"""
-            SELECT cart_item_id, quantity_required
-            FROM CartItems
-            WHERE cart_id = {cart_id} AND inventory_id = {inventory_id}
-        """)
-        if rows:
-            cart_item_id, cur_qty = rows[0]
-            new_qty = cur_qty + qty
-            current_app.db.execute(f"""
-                UPDATE CartItems
-                SET quantity_required = {new_qty}
-                WHERE cart_item_id = {cart_item_id}
-            """)
-            return cart_item_id, new_qty
+    def get_items(cart_id: int):
+        """
+        Return cart items with joined product + seller + price info.
+        Each row comes back as a tuple; map to dicts for templates/JSON.
+        """
+        return Cart.get_contents(cart_id)[0]
 
-        rows = current_app.db.execute(f"""
+    @staticmethod
+    def add_item(cart_id: int, inventory_id: int, qty: int):
+        """
+        Add or bump quantity for same inventory_id in this cart, as one
+        upsert on (cart_id, inventory_id).  Returns (cart_item_id, new_qty).
+        """
+        rows = current_app.db.execute("""
             INSERT INTO CartItems(cart_id, inventory_id, quantity_required)
-            VALUES ({cart_id}, {inventory_id}, {qty})
-            RETURNING cart_item_id
-        """)
-        return rows[0][0], qty
+            VALUES (:cart_id, :inventory_id, :qty)
+            ON CONFLICT (cart_id, inventory_id)
+            DO UPDATE SET quantity_required = CartItems.quantity_required + EXCLUDED.quantity_required
+            RETURNING cart_item_id, quantity_required
+        """, cart_id=cart_id, inventory_id=inventory_id, qty=qty)
+        return rows[0][0], rows[0][1]
+
+    @staticmethod
+    @transactional
+    def apply_batch(cart_id: int, adds=(), updates=(), removes=()):
+        """
+        Apply many edits to one cart in one transaction, with one statement
+        per kind of edit however many lines change:
+          adds     [(inventory_id, product_id, qty)]; give either id, a
+                   product_id means its first listing (as the cart_add
+                   route); repeated listings are summed; unknown ids ignored
+          updates  [(cart_item_id, qty)]; qty <= 0 removes the line
+          removes  [cart_item_id]
+        Adds go first, then updates, then removes.  A line never ends up
+        above MAX_LINE_QUANTITY; adds past it are capped.  Lines of other
+        carts are never touched.  Returns get_contents(cart_id).
+        """
+        updates = dict(updates)  # last update of a line wins
+        removes = set(removes) | {item_id for item_id, qty in updates.items() if qty <= 0}
+        updates = {item_id: qty for item_id, qty in updates.items() if item_id not in removes}
+
+        if adds:
+            current_app.db.execute("""
+                INSERT INTO CartItems(cart_id, inventory_id, quantity_required)
+                SELECT :cart_id, i.inventory_id, LEAST(SUM(a.quantity), :max_qty)
+                FROM unnest(CAST(:inventory_ids AS INT[]), CAST(:product_ids AS INT[]),
+                            CAST(:quantities AS INT[])) AS a(inventory_id, product_id, quantity)
+                JOIN LATERAL (
+                    SELECT inventory_id
+                    FROM Inventory
+                    WHERE inventory_id = a.inventory_id
+                       OR (a.inventory_id IS NULL AND product_id = a.product_id)
+                    ORDER BY inventory_id
+                    LIMIT 1
+                ) i ON true
+                GROUP BY i.inventory_id
+                ON CONFLICT (cart_id, inventory_id)
+                DO UPDATE SET quantity_required = LEAST(CartItems.quantity_required + EXCLUDED.quantity_required,
+                                                        :max_qty)
+            """, cart_id=cart_id, inventory_ids=[a[0] for a in adds],
+                product_ids=[a[1] for a in adds], quantities=[a[2] for a in adds],
+                max_qty=MAX_LINE_QUANTITY)
+        if updates:
+            current_app.db.execute("""
+                UPDATE CartItems ci
+                SET quantity_required = u.quantity
+                FROM unnest(CAST(:cart_item_ids AS INT[]), CAST(:quantities AS INT[])) AS u(cart_item_id, quantity)
+                WHERE ci.cart_item_id = u.cart_item_id AND ci.cart_id = :cart_id
+            """, cart_id=cart_id, cart_item_ids=list(updates), quantities=list(updates.values()))
+        if removes:
+            current_app.db.execute("""
+                DELETE FROM CartItems
+                WHERE cart_id = :cart_id AND cart_item_id = ANY(CAST(:cart_item_ids AS INT[]))
+            """, cart_id=cart_id, cart_item_ids=list(removes))
+        return Cart.get_contents(cart_id)
+
+    @staticmethod
+    def add_order_again(cart_id: int, order_id: int, user_id: int):
+        """
+        Put the products of one of user_id's orders back in the cart, each
+        from its cheapest in-stock listing and capped at that listing's
+        stock, in one statement (DISTINCT ON picks the listings, a
+        multi-row upsert adds them).  Returns [(product_name, ordered_qty,
+        added_qty)], added_qty 0 for products out of stock; [] if the order
+        isn't the user's or has no items.
+        """
+        rows = current_app.db.execute("""
+            WITH wanted AS (
+                SELECT i.product_id, SUM(oi.quantity_required) AS quantity
+                FROM Orders o
+                JOIN OrderItems oi ON oi.order_id = o.order_id
+                JOIN Inventory i ON i.inventory_id = oi.inventory_id
+                WHERE o.order_id = :order_id AND o.user_id = :user_id
+                GROUP BY i.product_id
+            ), cheapest AS (
+                SELECT DISTINCT ON (i.product_id) i.product_id, i.inventory_id, i.quantity
+                FROM Inventory i
+                JOIN wanted w ON w.product_id = i.product_id
+                WHERE i.quantity > 0
+                ORDER BY i.product_id, i.price, i.inventory_id
+            ), added AS (
+                INSERT INTO CartItems(cart_id, inventory_id, quantity_required)
+                SELECT :cart_id, c.inventory_id, LEAST(w.quantity, c.quantity)
+                FROM wanted w
+                JOIN cheapest c ON c.product_id = w.product_id
+                ON CONFLICT (cart_id, inventory_id)
+                DO UPDATE SET quantity_required = CartItems.quantity_required + EXCLUDED.quantity_required
+            )
+            SELECT p.name, w.quantity, LEAST(w.quantity, COALESCE(c.quantity, 0))
+            FROM wanted w
+            JOIN Products p ON p.product_id = w.product_id
+            LEFT JOIN cheapest c ON c.product_id = w.product_id
+            ORDER BY p.name
+        """, cart_id=cart_id, order_id=order_id, user_id=user_id)
+        return [(name, int(ordered), int(added)) for name, ordered, added in rows]
 
     @staticmethod
     def update_qty(cart_item_id: int, qty: int):
         """Set quantity; if qty <= 0, remove the item."""
         if qty <= 0:
-            current_app.db.execute(f"""
-                DELETE FROM CartItems
-                WHERE cart_item_id = {cart_item_id}
-            """)
+            Cart.remove_item(cart_item_id)
             return
-        current_app.db.execute(f"""
+        current_app.db.execute("""
             UPDATE CartItems
-            SET quantity_required = {qty}
-            WHERE cart_item_id = {cart_item_id}
-        """)
+            SET quantity_required = :qty
+            WHERE cart_item_id = :cart_item_id
+        """, qty=qty, cart_item_id=cart_item_id)
 
     @staticmethod
     def remove_item(cart_item_id: int):
-        current_app.db.execute(f"""
+        current_app.db.execute("""
             DELETE FROM CartItems
-            WHERE cart_item_id = {cart_item_id}
-        """)
+            WHERE cart_item_id = :cart_item_id
+        """, cart_item_id=cart_item_id)
 
     @staticmethod
     def clear(cart_id: int):
-        current_app.db.execute(f"""
+        current_app.db.execute("""
             DELETE FROM CartItems
-            WHERE cart_id = {cart_id}
-        """)
+            WHERE cart_id = :cart_id
+        """, cart_id=cart_id)
 
     @staticmethod
     def totals(cart_id: int):
         """
         Compute subtotal and total item count using current inventory prices.
         """
-        rows = current_app.db.execute(f"""
+        rows = current_app.db.execute("""
             SELECT COALESCE(SUM(ci.quantity_required * i.price), 0) AS subtotal,
                    COALESCE(SUM(ci.quantity_required), 0)          AS items_count
             FROM CartItems ci
             JOIN Inventory i ON ci.inventory_id = i.inventory_id
-            WHERE ci.cart_id = {cart_id}
-        """)
+            WHERE ci.cart_id = :cart_id
+        """, cart_id=cart_id)
         subtotal, items_count = rows[0]
         return float(subtotal), int(items_count)
\ No newline at end of file
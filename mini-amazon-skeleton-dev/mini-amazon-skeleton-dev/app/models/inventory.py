@@ -29,6 +29,8 @@ class Inventory:
             VALUES (:user_id, :product_id, :quantity, :price, (current_timestamp AT TIME ZONE 'UTC'))
             RETURNING inventory_id
         ''', user_id=user_id, product_id=product_id, quantity=quantity, price=price)
+        if rows:
+            app.cache_bus.publish('inventory', rows[0][0])
         return rows[0][0] if rows else None
 
     @staticmethod
@@ -39,6 +41,7 @@ class Inventory:
             SET quantity = :quantity, price = :price, price_updated_at = (current_timestamp AT TIME ZONE 'UTC')
             WHERE inventory_id = :inventory_id
         ''', inventory_id=inventory_id, quantity=quantity, price=price)
+        app.cache_bus.publish('inventory', inventory_id)
         return True
 
 
@@ -48,6 +51,7 @@ class Inventory:
             DELETE FROM Inventory
             WHERE inventory_id = :inventory_id
         ''', inventory_id=inventory_id)
+        app.cache_bus.publish('inventory', inventory_id)
         return True
 
     @staticmethod
@@ -0,0 +1,192 @@
+import os
+import threading
+import time
+
+from flask import current_app as app
+
+from ..db import read_committed, serializable, transactional
+
+
+# Stock set aside by everyone else's unexpired holds, as a scalar subquery
+# for a query over "Inventory i".  Served by an index-only scan of
+# idx_inventory_holds_active, so it costs one range scan per line.
+_HELD_EXCEPT = '''COALESCE((
+    SELECT SUM(h.quantity)
+    FROM InventoryHolds h
+    WHERE h.inventory_id = i.inventory_id
+      AND h.expires_at > (current_timestamp AT TIME ZONE 'UTC')
+      AND NOT ({mine})
+), 0)'''
+# ... for the live checkout of the cart bound as :cart_id
+HELD_BY_OTHERS = _HELD_EXCEPT.format(mine='h.cart_id = :cart_id AND h.order_id IS NULL')
+# ... for the queued order bound as :order_id
+HELD_BY_OTHER_ORDERS = _HELD_EXCEPT.format(mine='h.order_id IS NOT DISTINCT FROM :order_id')
+
+
+class InventoryHold:
+    """
+    Time-limited reservations of Inventory quantity.  A cart's live
+    checkout owns the holds with order_id NULL; Order.enqueue hands them to
+    the queued order (order_id set), so the buyer's next checkout on the
+    same cart neither replaces nor releases them.  Available stock is
+    Inventory.quantity minus everyone else's active holds (HELD_BY_OTHERS,
+    HELD_BY_OTHER_ORDERS).
+    """
+
+    @staticmethod
+    def place(cart_id):
+        """
+        Hold every line of the cart for INVENTORY_HOLD_SECONDS, replacing
+        the cart's previous holds.  A line asking for more than the others
+        have left gets no hold (checkout shows it as out of stock).
+        Returns the number of lines held.
+
+        If the cart's unexpired holds already match its lines (the buyer
+        reloaded checkout), that costs one read and nothing is locked or
+        written; the holds keep their original expiry.
+        """
+        held = InventoryHold._current(cart_id)
+        if held is not None:
+            return held
+        return InventoryHold._replace(cart_id)
+
+    @staticmethod
+    @read_committed
+    def _current(cart_id):
+        """Number of lines held if the holds cover exactly the cart's lines, else None."""
+        rows = app.db.execute('''
+WITH wanted AS (
+    SELECT inventory_id, SUM(quantity_required) AS quantity
+    FROM CartItems
+    WHERE cart_id = :cart_id
+    GROUP BY inventory_id
+), held AS (
+    SELECT inventory_id, quantity
+    FROM InventoryHolds
+    WHERE cart_id = :cart_id
+      AND order_id IS NULL
+      AND expires_at > (current_timestamp AT TIME ZONE 'UTC')
+)
+SELECT (SELECT COUNT(*) FROM held)
+WHERE NOT EXISTS (SELECT * FROM wanted EXCEPT SELECT * FROM held)
+  AND NOT EXISTS (SELECT * FROM held EXCEPT SELECT * FROM wanted)
+''', cart_id=cart_id)
+        return rows[0][0] if rows else None
+
+    @staticmethod
+    @serializable
+    @transactional
+    def _replace(cart_id):
+        # row locks make concurrent buyers queue for the same items instead of
+        # both reserving the last unit; inventory_id order avoids deadlocks
+        lines = app.db.execute(f'''
+SELECT i.inventory_id, i.quantity - {HELD_BY_OTHERS} AS available, c.requested
+FROM Inventory i
+JOIN (
+    SELECT inventory_id, SUM(quantity_required) AS requested
+    FROM CartItems
+    WHERE cart_id = :cart_id
+    GROUP BY inventory_id
+) c ON c.inventory_id = i.inventory_id
+ORDER BY i.inventory_id
+FOR UPDATE OF i
+''', cart_id=cart_id)
+        held = [(inventory_id, int(requested)) for inventory_id, available, requested in lines
+                if 0 < requested <= available]
+        inventory_ids = [inventory_id for inventory_id, _ in held]
+
+        app.db.execute('''
+DELETE FROM InventoryHolds
+WHERE cart_id = :cart_id
+  AND order_id IS NULL
+  AND NOT (inventory_id = ANY(CAST(:inventory_ids AS INT[])))
+''', cart_id=cart_id, inventory_ids=inventory_ids)
+        if held:
+            app.db.execute('''
+INSERT INTO InventoryHolds (inventory_id, cart_id, quantity, expires_at)
+SELECT h.inventory_id, :cart_id, h.quantity,
+       (current_timestamp AT TIME ZONE 'UTC') + make_interval(secs => :seconds)
+FROM unnest(CAST(:inventory_ids AS INT[]), CAST(:quantities AS INT[])) AS h(inventory_id, quantity)
+ON CONFLICT (inventory_id, cart_id) WHERE order_id IS NULL
+DO UPDATE SET quantity = EXCLUDED.quantity,
+              expires_at = EXCLUDED.expires_at
+''', cart_id=cart_id, inventory_ids=inventory_ids, quantities=[qty for _, qty in held],
+                           seconds=app.config['INVENTORY_HOLD_SECONDS'])
+        return len(held)
+
+    @staticmethod
+    def release(cart_id):
+        """Drop the holds of a cart's live checkout once it went through or was abandoned."""
+        return app.db.execute('''
+DELETE FROM InventoryHolds
+WHERE cart_id = :cart_id
+  AND order_id IS NULL
+''', cart_id=cart_id)
+
+    @staticmethod
+    def transfer(cart_id, order_id, inventory_ids, quantities):
+        """
+        Hand the cart's live holds on the queued order's lines to that
+        order, capped at the quantities it took; the rest are dropped.
+        Call in the transaction that queues the order.
+        """
+        app.db.execute('''
+UPDATE InventoryHolds h
+SET order_id = :order_id, quantity = LEAST(h.quantity, l.quantity)
+FROM unnest(CAST(:inventory_ids AS INT[]), CAST(:quantities AS INT[])) AS l(inventory_id, quantity)
+WHERE h.cart_id = :cart_id
+  AND h.order_id IS NULL
+  AND h.inventory_id = l.inventory_id
+''', cart_id=cart_id, order_id=order_id, inventory_ids=list(inventory_ids), quantities=list(quantities))
+        InventoryHold.release(cart_id)
+
+    @staticmethod
+    def release_order(order_id):
+        """Drop the holds a queued order owns once the worker finished it."""
+        return app.db.execute('''
+DELETE FROM InventoryHolds
+WHERE order_id = :order_id
+''', order_id=order_id)
+
+    @staticmethod
+    def expire():
+        """Delete every expired hold in one statement. Returns how many went."""
+        return app.db.execute('''
+DELETE FROM InventoryHolds
+WHERE expires_at <= (current_timestamp AT TIME ZONE 'UTC')
+''')
+
+
+class HoldSweeper:
+    """
+    Background thread that runs InventoryHold.expire() every
+    INVENTORY_HOLD_SWEEP_SECONDS.  Started lazily once per worker process
+    (app.before_request); expired holds are already ignored by the
+    availability queries, so this only keeps the table and its indexes small.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.interval = app.config['INVENTORY_HOLD_SWEEP_SECONDS']
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def start(self):
+        if self.interval <= 0 or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name="hold-sweeper", daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self.app.app_context():
+                try:
+                    expired = InventoryHold.expire()
+                    if expired:
+                        self.app.logger.info('expired %d inventory holds', expired)
+                except Exception:
+                    self.app.logger.exception('inventory hold sweep failed')
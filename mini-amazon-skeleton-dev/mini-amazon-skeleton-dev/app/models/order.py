@@ -0,0 +1,336 @@
+from flask import current_app as app
+
+from ..db import is_retryable, serializable, transactional
+from .product_stats import ProductStats
+from .inventory_hold import HELD_BY_OTHER_ORDERS, HELD_BY_OTHERS, InventoryHold
+from .user import User
+
+
+# (inventory_id, requested) sources for Order._lock_lines
+CART_LINES = '''
+    SELECT inventory_id, SUM(quantity_required) AS requested
+    FROM CartItems
+    WHERE cart_id = :cart_id
+    GROUP BY inventory_id
+'''
+JOB_LINES = '''
+    SELECT *
+    FROM unnest(CAST(:inventory_ids AS INT[]), CAST(:quantities AS INT[])) AS l(inventory_id, requested)
+'''
+
+
+class Order:
+    @staticmethod
+    @serializable
+    @transactional
+    def place(user_id, cart_id, idempotency_key=None):
+        """
+        Turn a cart into an order in one transaction: lock the cart's
+        Inventory rows, check stock (less other carts' holds), then write
+        the order, its items, the stock decrement, the sales counters, the
+        cart clear and the release of the cart's holds.  The number
+        of statements doesn't depend on the size of the cart.
+
+        The total is paid from the buyer's balance, with a BalanceLedger
+        entry, in the same transaction.
+
+        Returns the new order_id, or None if the cart is empty, asks for
+        more than is in stock or costs more than the balance (nothing is
+        written then).
+
+        With an idempotency_key, the key is claimed first; if this user
+        already used it, the order that attempt created is returned and
+        nothing else happens.
+        """
+        if idempotency_key is not None and not Order._claim_key(user_id, idempotency_key):
+            return Order.find_by_idempotency_key(user_id, idempotency_key)
+
+        lines = Order._lock_lines(CART_LINES, HELD_BY_OTHERS, cart_id=cart_id)
+        if lines is None:
+            if idempotency_key is not None:
+                # nothing was placed; let the buyer fix the cart and submit again
+                Order._release_key(user_id, idempotency_key)
+            return None
+
+        # pay from the balance in the same statement as the order row: the
+        # guarded UPDATE matches nothing if the buyer can't cover it, and
+        # then no order or ledger entry is written either
+        rows = app.db.execute('''
+WITH debit AS (
+    UPDATE Users
+    SET balance = balance - :total
+    WHERE id = :user_id AND balance - :total >= 0
+    RETURNING balance
+), new_order AS (
+    INSERT INTO Orders (user_id, total_price, status)
+    SELECT :user_id, :total, 'Pending'
+    FROM debit
+    RETURNING order_id
+), entry AS (
+    INSERT INTO BalanceLedger (user_id, amount, kind, order_id, balance_after)
+    SELECT :user_id, -:total, 'order', new_order.order_id, debit.balance
+    FROM debit, new_order
+)
+SELECT order_id FROM new_order
+''', user_id=user_id, total=Order._total(lines))
+        if not rows:
+            if idempotency_key is not None:
+                Order._release_key(user_id, idempotency_key)
+            return None
+        order_id = rows[0][0]
+        app.cache_bus.publish('users', user_id)
+        app.cache_bus.publish('orders', user_id)
+        Order._write_lines(order_id, lines)
+
+        app.db.execute('''
+DELETE FROM CartItems
+WHERE cart_id = :cart_id
+''', cart_id=cart_id)
+        InventoryHold.release(cart_id)
+        if idempotency_key is not None:
+            Order._record_key(user_id, idempotency_key, order_id)
+        return order_id
+
+    @staticmethod
+    @serializable
+    @transactional
+    def enqueue(user_id, cart_id, idempotency_key=None):
+        """
+        Async checkout (CHECKOUT_ASYNC): move the cart's lines into an
+        OrderJobs row and create the order with status 'Queued'; an
+        order_worker.py process places it later (see process_jobs).  Only
+        the cart is touched here, so the request never waits on stock locks.
+
+        Returns the order_id, the earlier order_id for a replayed
+        idempotency_key, or None for an empty cart.
+        """
+        if idempotency_key is not None and not Order._claim_key(user_id, idempotency_key):
+            return Order.find_by_idempotency_key(user_id, idempotency_key)
+
+        lines = app.db.execute(f'''
+SELECT c.inventory_id, c.requested, c.requested * i.price
+FROM ({CART_LINES}) c
+JOIN Inventory i ON i.inventory_id = c.inventory_id
+ORDER BY c.inventory_id
+''', cart_id=cart_id)
+        if not lines:
+            if idempotency_key is not None:
+                Order._release_key(user_id, idempotency_key)
+            return None
+
+        # the total is an estimate until the worker prices the locked rows
+        rows = app.db.execute('''
+WITH new_order AS (
+    INSERT INTO Orders (user_id, total_price, status)
+    VALUES (:user_id, :total, 'Queued')
+    RETURNING order_id
+)
+INSERT INTO OrderJobs (order_id, user_id, cart_id, inventory_ids, quantities)
+SELECT order_id, :user_id, :cart_id, CAST(:inventory_ids AS INT[]), CAST(:quantities AS INT[])
+FROM new_order
+RETURNING order_id
+''', user_id=user_id, cart_id=cart_id, total=sum(line[2] for line in lines),
+            inventory_ids=[line[0] for line in lines], quantities=[int(line[1]) for line in lines])
+        order_id = rows[0][0]
+        app.cache_bus.publish('orders', user_id)
+
+        app.db.execute('''
+DELETE FROM CartItems
+WHERE cart_id = :cart_id
+''', cart_id=cart_id)
+        # the stock held at checkout now belongs to the order; the buyer's
+        # next checkout on this cart starts with holds of its own
+        InventoryHold.transfer(cart_id, order_id, [line[0] for line in lines],
+                               [int(line[1]) for line in lines])
+        if idempotency_key is not None:
+            Order._record_key(user_id, idempotency_key, order_id)
+        return order_id
+
+    @staticmethod
+    @serializable
+    @transactional
+    def process_jobs(batch_size=10):
+        """
+        Claim up to batch_size queued jobs (FOR UPDATE SKIP LOCKED, so any
+        number of workers can drain the queue side by side) and place each
+        order, paying from the buyer's balance: status 'Pending' once placed,
+        or 'Failed' with the lines put back in the buyer's cart when stock or
+        the balance ran out.
+
+        Each job runs under its own savepoint, so one that raises only
+        undoes itself: its attempts count goes up and the error is kept,
+        and at ORDER_JOB_MAX_ATTEMPTS it is failed like an out-of-stock
+        one instead of blocking the head of the queue.  Returns the number
+        of jobs that finished.
+        """
+        jobs = app.db.execute('''
+SELECT job_id, order_id, user_id, cart_id, inventory_ids, quantities, attempts
+FROM OrderJobs
+WHERE status = 'queued'
+ORDER BY job_id
+LIMIT :batch_size
+FOR UPDATE SKIP LOCKED
+''', batch_size=batch_size)
+        finished = 0
+        for job in jobs:
+            try:
+                with app.db.savepoint():
+                    Order._place_job(*job[:6])
+                finished += 1
+            except Exception as exc:
+                if is_retryable(exc):
+                    raise
+                if Order._job_raised(*job, exc):
+                    finished += 1
+        return finished
+
+    @staticmethod
+    def _place_job(job_id, order_id, user_id, cart_id, inventory_ids, quantities):
+        lines = Order._lock_lines(JOB_LINES, HELD_BY_OTHER_ORDERS, order_id=order_id,
+                                  inventory_ids=inventory_ids, quantities=quantities)
+        if lines is None:
+            error = 'insufficient stock'
+        elif not User.update_balance(user_id, -Order._total(lines), 'order', order_id)[0]:
+            error = 'insufficient funds'
+        else:
+            Order._write_lines(order_id, lines)
+            Order._finish_job(job_id, order_id, user_id, None, Order._total(lines))
+            return
+        Order._fail_job(job_id, order_id, user_id, cart_id, inventory_ids, quantities, error)
+
+    @staticmethod
+    def _job_raised(job_id, order_id, user_id, cart_id, inventory_ids, quantities, attempts, exc):
+        """Count a failed attempt; True if that was the last one and the job is now failed."""
+        attempts += 1
+        error = f'{type(exc).__name__}: {exc}'
+        failed = attempts >= app.config['ORDER_JOB_MAX_ATTEMPTS']
+        app.logger.warning('order job %s raised (attempt %d of %d)', job_id, attempts,
+                           app.config['ORDER_JOB_MAX_ATTEMPTS'], exc_info=exc)
+        if failed:
+            try:
+                with app.db.savepoint():
+                    Order._fail_job(job_id, order_id, user_id, cart_id, inventory_ids, quantities, error)
+            except Exception as fail_exc:
+                if is_retryable(fail_exc):
+                    raise
+                # still take the job off the queue below
+                app.logger.exception('could not fail order job %s cleanly', job_id)
+        app.db.execute('''
+UPDATE OrderJobs
+SET attempts = :attempts, error = :error,
+    status = CASE WHEN :failed THEN 'failed' ELSE status END,
+    finished_at = CASE WHEN :failed THEN (current_timestamp AT TIME ZONE 'UTC') ELSE finished_at END
+WHERE job_id = :job_id
+''', attempts=attempts, error=error, failed=failed, job_id=job_id)
+        return failed
+
+    @staticmethod
+    def _fail_job(job_id, order_id, user_id, cart_id, inventory_ids, quantities, error):
+        """Put the job's lines back in the buyer's cart and mark it and its order failed."""
+        app.db.execute('''
+INSERT INTO CartItems (cart_id, inventory_id, quantity_required)
+SELECT :cart_id, l.inventory_id, l.quantity
+FROM unnest(CAST(:inventory_ids AS INT[]), CAST(:quantities AS INT[])) AS l(inventory_id, quantity)
+ON CONFLICT (cart_id, inventory_id)
+DO UPDATE SET quantity_required = CartItems.quantity_required + EXCLUDED.quantity_required
+''', cart_id=cart_id, inventory_ids=inventory_ids, quantities=quantities)
+        Order._finish_job(job_id, order_id, user_id, error, 0)
+
+    @staticmethod
+    def _finish_job(job_id, order_id, user_id, error, total):
+        """Close the job ('done', or 'failed' with error) and its order, and free its holds."""
+        status, job_status = ('Pending', 'done') if error is None else ('Failed', 'failed')
+        app.db.execute('''
+WITH job AS (
+    UPDATE OrderJobs
+    SET status = :job_status, error = :error,
+        finished_at = (current_timestamp AT TIME ZONE 'UTC')
+    WHERE job_id = :job_id
+)
+UPDATE Orders
+SET status = :status, total_price = :total
+WHERE order_id = :order_id
+''', job_status=job_status, error=error, job_id=job_id, status=status, total=total, order_id=order_id)
+        # only the holds this order owns: the buyer may be checking out again with the same cart
+        InventoryHold.release_order(order_id)
+        app.cache_bus.publish('orders', user_id)
+
+    @staticmethod
+    def find_by_idempotency_key(user_id, idempotency_key):
+        """order_id placed by an earlier submit with this key, or None."""
+        rows = app.db.execute('''
+SELECT order_id
+FROM CheckoutIdempotencyKeys
+WHERE user_id = :user_id AND idempotency_key = :idempotency_key
+''', user_id=user_id, idempotency_key=idempotency_key)
+        return rows[0][0] if rows else None
+
+    @staticmethod
+    def _lock_lines(source, held, **params):
+        """
+        Lock the Inventory rows for the (inventory_id, requested) lines of
+        source and check each against stock less the holds of others (held:
+        HELD_BY_OTHERS or HELD_BY_OTHER_ORDERS, with their parameters).
+        Returns [(inventory_id, product_id, price, available, requested)],
+        or None if there are no lines or any of them can't be met.
+        """
+        # lock in inventory_id order so two checkouts sharing items can't deadlock
+        lines = app.db.execute(f'''
+SELECT i.inventory_id, i.product_id, i.price, i.quantity - {held} AS available, c.requested
+FROM Inventory i
+JOIN ({source}) c ON c.inventory_id = i.inventory_id
+ORDER BY i.inventory_id
+FOR UPDATE OF i
+''', **params)
+        if not lines or any(not 0 < requested <= available for _, _, _, available, requested in lines):
+            return None
+        return lines
+
+    @staticmethod
+    def _total(lines):
+        return sum(price * requested for _, _, price, _, requested in lines)
+
+    @staticmethod
+    def _write_lines(order_id, lines):
+        """OrderItems, stock decrement and sales counters for locked lines."""
+        inventory_ids = [line[0] for line in lines]
+        quantities = [int(line[4]) for line in lines]
+        app.db.execute('''
+INSERT INTO OrderItems (order_id, inventory_id, quantity_required, final_unit_price, individual_fulfillment)
+SELECT :order_id, l.inventory_id, l.quantity, l.price, 'Not Yet Fulfilled'
+FROM unnest(CAST(:inventory_ids AS INT[]), CAST(:quantities AS INT[]), CAST(:prices AS DECIMAL[]))
+       AS l(inventory_id, quantity, price)
+''', order_id=order_id, inventory_ids=inventory_ids, quantities=quantities,
+            prices=[line[2] for line in lines])
+        app.db.execute('''
+UPDATE Inventory i
+SET quantity = i.quantity - l.quantity
+FROM unnest(CAST(:inventory_ids AS INT[]), CAST(:quantities AS INT[])) AS l(inventory_id, quantity)
+WHERE i.inventory_id = l.inventory_id
+''', inventory_ids=inventory_ids, quantities=quantities)
+        ProductStats.record_sales([(line[1], qty) for line, qty in zip(lines, quantities)])
+
+    @staticmethod
+    def _claim_key(user_id, idempotency_key):
+        """True if this call owns the key; False if an earlier submit used it."""
+        return bool(app.db.execute('''
+INSERT INTO CheckoutIdempotencyKeys (user_id, idempotency_key)
+VALUES (:user_id, :idempotency_key)
+ON CONFLICT (user_id, idempotency_key) DO NOTHING
+RETURNING idempotency_key
+''', user_id=user_id, idempotency_key=idempotency_key))
+
+    @staticmethod
+    def _record_key(user_id, idempotency_key, order_id):
+        app.db.execute('''
+UPDATE CheckoutIdempotencyKeys
+SET order_id = :order_id
+WHERE user_id = :user_id AND idempotency_key = :idempotency_key
+''', order_id=order_id, user_id=user_id, idempotency_key=idempotency_key)
+
+    @staticmethod
+    def _release_key(user_id, idempotency_key):
+        app.db.execute('''
+DELETE FROM CheckoutIdempotencyKeys
+WHERE user_id = :user_id AND idempotency_key = :idempotency_key
+''', user_id=user_id, idempotency_key=idempotency_key)
@@ -1,4 +1,289 @@
 from flask import current_app as app
+from sqlalchemy import text
+
+from ..db import read_committed
+from collections import OrderedDict
+from decimal import Decimal, InvalidOperation
+import base64
+import json
+import threading
+import time
+
+# browse page size; callers may ask for less but never more than MAX_PAGE_SIZE
+PAGE_SIZE = 24
+MAX_PAGE_SIZE = 100
+
+# keyset columns for each sort option: (sort expression, direction, SQL type of the cursor value).
+# product_id is always appended as a tiebreak in the same direction so (key, product_id) is unique.
+KEYSET_SORTS = {
+    "name_asc": ("p.name", "ASC", "VARCHAR"),
+    "name_desc": ("p.name", "DESC", "VARCHAR"),
+    "price_asc": ("p.price", "ASC", "DECIMAL"),
+    "price_desc": ("p.price", "DESC", "DECIMAL"),
+    "rating_asc": ("ps.avg_rating", "ASC", "DECIMAL"),
+    "rating_desc": ("ps.avg_rating", "DESC", "DECIMAL"),
+    "sales_asc": ("ps.units_sold", "ASC", "INT"),
+    "sales_desc": ("ps.units_sold", "DESC", "INT"),
+}
+
+# price facet buckets: [low, high) in dollars; None means unbounded
+PRICE_BUCKETS = [
+    (0, 25, "Under $25"),
+    (25, 50, "$25 to $50"),
+    (50, 100, "$50 to $100"),
+    (100, 250, "$100 to $250"),
+    (250, 500, "$250 to $500"),
+    (500, None, "$500 & up"),
+]
+
+def _price_bucket_filter(price_bucket):
+    """SQL condition on p.price for a PRICE_BUCKETS index, or '' if out of range."""
+    if price_bucket is None or not 0 <= price_bucket < len(PRICE_BUCKETS):
+        return ""
+    low, high, _ = PRICE_BUCKETS[price_bucket]
+    cond = f" AND p.price >= {low}"
+    if high is not None:
+        cond += f" AND p.price < {high}"
+    return cond
+
+
+def _facet_sql(category_filter, price_filter):
+    """
+    One scalar subquery that returns the facet counts as JSON.  Category
+    counts respect the price filter but not the category filter, and price
+    bucket counts the other way round, so every option shows how many
+    products picking it would give.
+    """
+    bucket_counts = ",\n".join(
+        f"COUNT(*) FILTER (WHERE p.price >= {low}" + (f" AND p.price < {high})" if high is not None else ")")
+        for low, high, _ in PRICE_BUCKETS
+    )
+    return f'''(
+    SELECT json_build_object(
+        'categories', (
+            SELECT COALESCE(json_object_agg(c.category, c.n ORDER BY c.category), '{{}}'::json)
+            FROM (
+                SELECT p.category, COUNT(*) AS n
+                FROM Products p
+                WHERE p.available = :available AND p.category <> ''{price_filter}
+                GROUP BY p.category
+            ) c
+        ),
+        'prices', (
+            SELECT json_build_array(
+{bucket_counts}
+            )
+            FROM Products p
+            WHERE p.available = :available{category_filter}
+        )
+    )
+)'''
+
+
+def _facets_from_json(raw):
+    return {
+        "categories": raw["categories"],
+        "prices": [
+            {"bucket": i, "label": label, "count": count}
+            for i, ((_, _, label), count) in enumerate(zip(PRICE_BUCKETS, raw["prices"]))
+        ],
+    }
+
+
+def encode_cursor(sort_value, product_id):
+    raw = json.dumps([str(sort_value), product_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+# Python type each KEYSET_SORTS SQL type is checked against before it reaches a CAST
+_CURSOR_TYPES = {"VARCHAR": str, "DECIMAL": Decimal, "INT": int}
+
+
+def decode_cursor(cursor, value_type="VARCHAR"):
+    """
+    Return (sort_value, product_id) or None for a missing/garbled cursor.
+    sort_value must parse as value_type (see KEYSET_SORTS), so a cursor from
+    another sort, or a hand-edited one, starts over at the first page
+    instead of failing the query's CAST.
+    """
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        sort_value, product_id = json.loads(raw)
+        sort_value = _CURSOR_TYPES[value_type](str(sort_value))
+        if isinstance(sort_value, Decimal) and not sort_value.is_finite():
+            return None
+        return sort_value, int(product_id)
+    except (ValueError, TypeError, InvalidOperation):
+        return None
+
+
+class _CatalogRecord:
+    """One available product in the catalog snapshot."""
+    __slots__ = ("product_id", "name", "price", "description", "image", "category",
+                 "seller_name", "seller_id", "avg_rating", "total_sales", "name_rank")
+
+    def __init__(self, row, name_rank):
+        (self.product_id, self.name, self.price, self.description, self.image, self.category,
+         self.seller_name, self.seller_id, self.avg_rating, self.total_sales) = row
+        self.name_rank = name_rank
+
+    def to_product(self):
+        product = Product(self.product_id, self.name, self.price, True, self.description,
+                          self.image, self.category, self.avg_rating, self.total_sales)
+        product.seller_name = self.seller_name
+        product.seller_id = self.seller_id
+        return product
+
+
+# record attribute each KEYSET_SORTS option orders by in memory.  Names use
+# their position in the database's ORDER BY p.name so the in-memory order
+# matches the collation the SQL path pages with.
+_SNAPSHOT_SORT_FIELDS = {
+    "p.name": ("name_rank", "name"),
+    "p.price": ("price", "price"),
+    "ps.avg_rating": ("avg_rating", "avg_rating"),
+    "ps.units_sold": ("total_sales", "total_sales"),
+}
+
+
+class _Snapshot:
+    def __init__(self, version, rows):
+        self.version = version
+        self.built_at = time.monotonic()
+        self.records = {}
+        for rank, row in enumerate(rows):
+            self.records[row[0]] = _CatalogRecord(row, rank)
+        self.categories = sorted({r.category for r in self.records.values() if r.category})
+
+
+class CatalogCache:
+    """
+    Process-local copy of the browsable catalog.
+
+    The snapshot holds every available product as a _CatalogRecord keyed by
+    id.  Sorted id lists for each (sort column, category, price bucket) a
+    browse page asks for are built from it on demand and kept in an LRU, as
+    are Product.get lookups for unavailable products, search results and
+    facet counts.
+
+    Every catalog write (Product.create/update, Inventory.add/update/delete,
+    review changes) is published on app.cache_bus, and each worker answers
+    with invalidate(), which bumps the version and drops everything; the
+    next read rebuilds.  Ratings and sales change without a catalog write,
+    so entries also expire after CATALOG_CACHE_TTL seconds.  A TTL of 0
+    turns the cache off and every read goes to the database.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rebuild_lock = threading.Lock()   # one snapshot query at a time
+        self.version = 0
+        self._snapshot = None
+        self._lru = OrderedDict()   # key -> (version, expires, value)
+
+    @staticmethod
+    def ttl():
+        return app.config['CATALOG_CACHE_TTL']
+
+    def enabled(self):
+        return self.ttl() > 0
+
+    def invalidate(self):
+        with self._lock:
+            self.version += 1
+            self._snapshot = None
+            self._lru.clear()
+
+    def _fresh(self, snap):
+        return snap is not None and time.monotonic() - snap.built_at < self.ttl()
+
+    def snapshot(self):
+        """
+        The current snapshot, rebuilt by one thread at a time.  When the TTL
+        runs out, the other threads keep serving the expired copy until the
+        rebuild lands; after invalidate() there is no copy, so they wait
+        for it instead.
+        """
+        snap = self._snapshot
+        if self._fresh(snap):
+            return snap
+        if not self._rebuild_lock.acquire(blocking=snap is None):
+            return snap
+        try:
+            # another thread may have rebuilt it while we waited for the lock
+            current = self._snapshot
+            if self._fresh(current):
+                return current
+            return self._rebuild()
+        finally:
+            self._rebuild_lock.release()
+
+    def _rebuild(self):
+        version = self.version
+        rows = app.db.execute('''
+SELECT p.product_id, p.name, p.price, p.description, COALESCE(p.image, '') AS image, COALESCE(p.category, '') AS category,
+       COALESCE(u.firstname || ' ' || u.lastname, 'Unknown Seller') AS seller_name,
+       p.seller_id,
+       ps.avg_rating,
+       ps.units_sold AS total_sales
+FROM Products p
+JOIN ProductStats ps ON p.product_id = ps.product_id
+LEFT JOIN Users u ON p.seller_id = u.id
+WHERE p.available = TRUE
+ORDER BY p.name ASC, p.product_id ASC
+''')
+        snap = _Snapshot(version, rows)
+        with self._lock:
+            # a write that landed while we were reading makes this copy stale
+            if self.version == version:
+                self._snapshot = snap
+        return snap
+
+    def get(self, key):
+        with self._lock:
+            entry = self._lru.get(key)
+            if entry is None:
+                return None
+            version, expires, value = entry
+            if version != self.version or expires < time.monotonic():
+                del self._lru[key]
+                return None
+            self._lru.move_to_end(key)
+            return value
+
+    def put(self, key, value, version):
+        with self._lock:
+            if version != self.version:
+                return
+            self._lru[key] = (version, time.monotonic() + self.ttl(), value)
+            self._lru.move_to_end(key)
+            while len(self._lru) > app.config['CATALOG_CACHE_SIZE']:
+                self._lru.popitem(last=False)
+
+    def sorted_ids(self, snap, field, category, price_bucket):
+        """Ascending (field, product_id) order of the snapshot records passing the filters."""
+        key = ("ids", snap.built_at, field, category, price_bucket)
+        ids = self.get(key)
+        if ids is None:
+            low = high = None
+            if price_bucket is not None:
+                low, high, _ = PRICE_BUCKETS[price_bucket]
+            records = [
+                r for r in snap.records.values()
+                if (category is None or r.category == category)
+                and (low is None or (r.price >= low and (high is None or r.price < high)))
+            ]
+            records.sort(key=lambda r: (getattr(r, field), r.product_id))
+            ids = ([r.product_id for r in records],
+                   {r.product_id: i for i, r in enumerate(records)})
+            self.put(key, ids, snap.version)
+        return ids
+
+
+catalog_cache = CatalogCache()
+
 
 class Product:
     def __init__(self, product_id, name, price, available, description=None, image=None, category=None, avg_rating=0, total_sales=0):
@@ -15,7 +300,18 @@ class Product:
         self.total_sales = int(total_sales) if total_sales else 0
 
     @staticmethod
+    @read_committed
     def get(product_id):
+        cached = catalog_cache.enabled()
+        version = catalog_cache.version
+        if cached:
+            record = catalog_cache.snapshot().records.get(product_id)
+            if record is not None:
+                return record.to_product()
+            # unavailable products aren't in the snapshot but are still linked from orders
+            row = catalog_cache.get(("product", product_id))
+            if row is not None:
+                return Product._from_detail_row(row)
         rows = app.db.execute('''
 SELECT p.product_id, p.name, p.price, p.available, p.description, COALESCE(p.image, '') AS image, COALESCE(p.category, '') AS category,
        COALESCE(u.firstname || ' ' || u.lastname, 'Unknown Seller') AS seller_name,
@@ -26,13 +322,20 @@ WHERE p.product_id = :product_id
 ''',
                               product_id=product_id)
         if rows:
-            product = Product(*rows[0][:7])
-            product.seller_name = rows[0][7]
-            product.seller_id = rows[0][8]
-            return product
+            if cached:
+                catalog_cache.put(("product", product_id), tuple(rows[0]), version)
+            return Product._from_detail_row(rows[0])
         return None
 
     @staticmethod
+    def _from_detail_row(row):
+        product = Product(*row[:7])
+        product.seller_name = row[7]
+        product.seller_id = row[8]
+        return product
+
+    @staticmethod
+    @read_committed
     def get_all(available=True, sort: str = "name_asc", category: str | None = None):
         # our whitelist supported sort options to prevent SQL injection
         sort_map = {
@@ -47,25 +350,24 @@ WHERE p.product_id = :product_id
         }
         order_clause = sort_map.get(sort, "name ASC")
 
+        if available and catalog_cache.enabled():
+            sort_expr, sort_dir, _ = KEYSET_SORTS.get(sort, KEYSET_SORTS["name_asc"])
+            snap = catalog_cache.snapshot()
+            ids, _ = catalog_cache.sorted_ids(snap, _SNAPSHOT_SORT_FIELDS[sort_expr][0],
+                                              category if category and category.lower() != 'all' else None, None)
+            if sort_dir == "DESC":
+                ids = ids[::-1]
+            return [snap.records[pid].to_product() for pid in ids]
+
         base = '''
 SELECT p.product_id, p.name, p.price, p.available, p.description, COALESCE(p.image, '') AS image, COALESCE(p.category, '') AS category,
        COALESCE(u.firstname || ' ' || u.lastname, 'Unknown Seller') AS seller_name,
-       COALESCE(pr.avg_rating, 0) AS avg_rating,
-       COALESCE(oi.total_sales, 0) AS total_sales,
+       COALESCE(ps.avg_rating, 0) AS avg_rating,
+       COALESCE(ps.units_sold, 0) AS total_sales,
        p.seller_id
 FROM Products p
 LEFT JOIN Users u ON p.seller_id = u.id
-LEFT JOIN (
-    SELECT product_id, AVG(rating) AS avg_rating
-    FROM ProductReviews
-    GROUP BY product_id
-) pr ON p.product_id = pr.product_id
-LEFT JOIN (
-    SELECT i.product_id, COUNT(oi.order_id) AS total_sales
-    FROM OrderItems oi
-    JOIN Inventory i ON oi.inventory_id = i.inventory_id
-    GROUP BY i.product_id
-) oi ON p.product_id = oi.product_id
+LEFT JOIN ProductStats ps ON p.product_id = ps.product_id
 WHERE p.available = :available
 '''
         params = {"available": available}
@@ -84,60 +386,361 @@ WHERE p.available = :available
         return products
 
     @staticmethod
+    @read_committed
+    def get_page(available=True, sort: str = "name_asc", category: str | None = None,
+                 cursor: str | None = None, direction: str = "next", limit: int = PAGE_SIZE,
+                 price_bucket: int | None = None, with_facets: bool = False):
+        """
+        Keyset-paginated version of get_all.  cursor is an opaque token from a
+        previous page's next_cursor/prev_cursor; direction says which way to walk
+        from it.  Each page is one indexed range scan of limit + 1 rows, so deep
+        pages cost the same as the first one.  price_bucket filters on one of
+        PRICE_BUCKETS.
+
+        Returns {'products', 'next_cursor', 'prev_cursor', 'limit'}, plus
+        'facets' (see get_facets) when with_facets is set.  Uncached facets are
+        computed by a subquery of the page query itself, so a cold page is
+        still one round trip.
+
+        Available products are paged from catalog_cache when it is enabled;
+        cursors are interchangeable between the two paths.
+        """
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        if available and catalog_cache.enabled():
+            page = Product._page_from_snapshot(sort, category, cursor, direction, limit,
+                                               price_bucket, with_facets)
+            if page is not None:
+                return page
+        sort_expr, sort_dir, value_type = KEYSET_SORTS.get(sort, KEYSET_SORTS["name_asc"])
+        backwards = direction == "prev"
+        if backwards:
+            sort_dir = "DESC" if sort_dir == "ASC" else "ASC"
+        after = decode_cursor(cursor, value_type)
+
+        params = {"available": available, "limit": limit + 1}
+        category_filter = ""
+        if category and category.lower() != 'all':
+            category_filter = " AND p.category = :category"
+            params["category"] = category
+        price_filter = _price_bucket_filter(price_bucket)
+
+        facet_key = ("facets", available, category if category_filter else None,
+                     price_bucket if price_filter else None)
+        version = catalog_cache.version
+        facets = catalog_cache.get(facet_key) if with_facets and catalog_cache.enabled() else None
+        facet_column = ""
+        if with_facets and facets is None:
+            facet_column = ",\n       " + _facet_sql(category_filter, price_filter) + " AS facets"
+
+        base = f'''
+SELECT p.product_id, p.name, p.price, p.available, p.description, COALESCE(p.image, '') AS image, COALESCE(p.category, '') AS category,
+       COALESCE(u.firstname || ' ' || u.lastname, 'Unknown Seller') AS seller_name,
+       ps.avg_rating,
+       ps.units_sold AS total_sales,
+       p.seller_id,
+       {sort_expr} AS sort_value{facet_column}
+FROM Products p
+JOIN ProductStats ps ON p.product_id = ps.product_id
+LEFT JOIN Users u ON p.seller_id = u.id
+WHERE p.available = :available{category_filter}{price_filter}
+'''
+        if after:
+            op = ">" if sort_dir == "ASC" else "<"
+            base += f" AND ({sort_expr}, p.product_id) {op} (CAST(:after_value AS {value_type}), :after_id)\n"
+            params["after_value"], params["after_id"] = after
+        base += f"ORDER BY {sort_expr} {sort_dir}, p.product_id {sort_dir}\nLIMIT :limit\n"
+        rows = app.db.execute(base, **params)
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if backwards:
+            rows = rows[::-1]
+
+        products = []
+        for row in rows:
+            product = Product(*row[:7], row[8], row[9])
+            product.seller_name = row[7]
+            product.seller_id = row[10]
+            products.append(product)
+
+        first = encode_cursor(rows[0][11], rows[0][0]) if rows else None
+        last = encode_cursor(rows[-1][11], rows[-1][0]) if rows else None
+        if backwards:
+            # we came from the page after this one, so it always exists
+            next_cursor, prev_cursor = last, (first if has_more else None)
+        else:
+            next_cursor, prev_cursor = (last if has_more else None), (first if after else None)
+        page = {
+            "products": products,
+            "next_cursor": next_cursor,
+            "prev_cursor": prev_cursor,
+            "limit": limit,
+        }
+        if with_facets:
+            if facets is None:
+                # an empty page has no row to carry the facet column
+                facets = (_facets_from_json(rows[0][12]) if rows
+                          else Product.get_facets(available, category, price_bucket))
+                if catalog_cache.enabled():
+                    catalog_cache.put(facet_key, facets, version)
+            page["facets"] = facets
+        return page
+
+    @staticmethod
+    def _page_from_snapshot(sort, category, cursor, direction, limit, price_bucket, with_facets):
+        """get_page over the in-memory snapshot; None if the cursor row is no longer in it."""
+        sort_expr, sort_dir, value_type = KEYSET_SORTS.get(sort, KEYSET_SORTS["name_asc"])
+        field, value_attr = _SNAPSHOT_SORT_FIELDS[sort_expr]
+        if not category or category.lower() == 'all':
+            category = None
+        if price_bucket is not None and not 0 <= price_bucket < len(PRICE_BUCKETS):
+            price_bucket = None
+
+        snap = catalog_cache.snapshot()
+        ids, positions = catalog_cache.sorted_ids(snap, field, category, price_bucket)
+        n = len(ids)
+        descending = sort_dir == "DESC"
+
+        after = decode_cursor(cursor, value_type)
+        if after:
+            pos = positions.get(after[1])
+            if pos is None:
+                return None
+            k = n - 1 - pos if descending else pos
+            if direction == "prev":
+                start, end = max(0, k - limit), k
+            else:
+                start, end = k + 1, min(n, k + 1 + limit)
+        else:
+            start, end = 0, min(n, limit)
+
+        records = [snap.records[ids[n - 1 - j] if descending else ids[j]] for j in range(start, end)]
+        page = {
+            "products": [r.to_product() for r in records],
+            "next_cursor": (encode_cursor(getattr(records[-1], value_attr), records[-1].product_id)
+                            if records and end < n else None),
+            "prev_cursor": (encode_cursor(getattr(records[0], value_attr), records[0].product_id)
+                            if records and start > 0 else None),
+            "limit": limit,
+        }
+        if with_facets:
+            facet_key = ("facets", True, category, price_bucket)
+            facets = catalog_cache.get(facet_key)
+            if facets is None:
+                facets = Product.get_facets(True, category, price_bucket)
+                catalog_cache.put(facet_key, facets, snap.version)
+            page["facets"] = facets
+        return page
+
+    @staticmethod
+    @read_committed
+    def get_facets(available=True, category: str | None = None, price_bucket: int | None = None):
+        """
+        Facet counts for a browse filter:
+        {'categories': {name: count}, 'prices': [{bucket, label, count}]}.
+        """
+        params = {"available": available}
+        category_filter = ""
+        if category and category.lower() != 'all':
+            category_filter = " AND p.category = :category"
+            params["category"] = category
+        rows = app.db.execute(
+            "SELECT " + _facet_sql(category_filter, _price_bucket_filter(price_bucket)), **params)
+        return _facets_from_json(rows[0][0])
+
+    @staticmethod
+    def invalidate_cache():
+        """Drop cached catalog data after a write to Products or Inventory."""
+        catalog_cache.invalidate()
+
+    @staticmethod
+    @read_committed
     def get_categories():
+        cached = catalog_cache.enabled()
+        if cached:
+            categories = catalog_cache.get(("categories",))
+            if categories is not None:
+                return list(categories)
+        version = catalog_cache.version
         rows = app.db.execute('''
 SELECT DISTINCT category
 FROM Products
 WHERE category IS NOT NULL AND category <> ''
 ORDER BY category ASC
 ''')
-        return [r[0] for r in rows]
+        categories = [r[0] for r in rows]
+        if cached:
+            catalog_cache.put(("categories",), tuple(categories), version)
+        return categories
 
     @staticmethod
     def create(name, description, price, seller_id, category=None, image=None):
         """Create a new product and return the product_id"""
+        # the ProductStats row is created in the same statement so the
+        # product shows up in browse/search with zeroed aggregates
         rows = app.db.execute('''
-INSERT INTO Products (name, description, price, seller_id, category, image, available)
-VALUES (:name, :description, :price, :seller_id, :category, :image, TRUE)
+WITH new_product AS (
+    INSERT INTO Products (name, description, price, seller_id, category, image, available)
+    VALUES (:name, :description, :price, :seller_id, :category, :image, TRUE)
+    RETURNING product_id
+)
+INSERT INTO ProductStats (product_id)
+SELECT product_id FROM new_product
 RETURNING product_id
 ''', name=name, description=description, price=price, seller_id=seller_id, 
             category=category, image=image)
+        if rows:
+            app.cache_bus.publish('product', rows[0][0])
         return rows[0][0] if rows else None
 
     @staticmethod
-    def search(query):
-        """Search products by name and description"""
-        search_term = f"%{query}%"
-        rows = app.db.execute('''
+    @read_committed
+    def search(query, sort: str = "relevance", page: int = 1, limit: int = PAGE_SIZE, fuzzy: bool = False):
+        """
+        Full-text search over name, category and description using the
+        GIN-indexed Products.search_vector.  sort is "relevance" (weighted
+        ts_rank_cd) or any get_all sort option; page is 1-based.
+
+        Returns {'products', 'terms', 'page', 'has_next', 'limit'} where terms
+        are the stemmed query lexemes, for highlight_search.
+
+        With fuzzy=True, names are matched by trigram word similarity instead
+        (see fuzzy_search), which tolerates typos such as "camra".
+
+        Results are kept in catalog_cache until the next catalog write.
+        """
+        cached = catalog_cache.enabled()
+        key = ("search", query, sort, page, limit, fuzzy)
+        if cached:
+            results = catalog_cache.get(key)
+            if results is not None:
+                return results
+        version = catalog_cache.version
+        if fuzzy:
+            results = Product.fuzzy_search(query, sort=sort, page=page, limit=limit)
+        else:
+            results = Product._full_text_search(query, sort=sort, page=page, limit=limit)
+        if cached:
+            catalog_cache.put(key, results, version)
+        return results
+
+    @staticmethod
+    def _full_text_search(query, sort, page, limit):
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        page = max(1, int(page))
+        if sort in KEYSET_SORTS:
+            sort_expr, sort_dir, _ = KEYSET_SORTS[sort]
+            order_clause = f"{sort_expr} {sort_dir}, p.product_id {sort_dir}"
+        else:
+            order_clause = "rank DESC, p.product_id ASC"
+
+        rows = app.db.execute(f'''
+WITH q AS (
+    SELECT websearch_to_tsquery('english', :query) AS tsq,
+           tsvector_to_array(to_tsvector('english', :query)) AS terms
+)
 SELECT p.product_id, p.name, p.price, p.available, p.description, COALESCE(p.image, '') AS image, COALESCE(p.category, '') AS category,
        COALESCE(u.firstname || ' ' || u.lastname, 'Unknown Seller') AS seller_name,
-       COALESCE(pr.avg_rating, 0) AS avg_rating,
-       COALESCE(oi.total_sales, 0) AS total_sales, p.seller_id
+       ps.avg_rating,
+       ps.units_sold AS total_sales, p.seller_id,
+       q.terms,
+       ts_rank_cd(p.search_vector, q.tsq) AS rank
 FROM Products p
+CROSS JOIN q
+JOIN ProductStats ps ON p.product_id = ps.product_id
 LEFT JOIN Users u ON p.seller_id = u.id
-LEFT JOIN (
-    SELECT product_id, AVG(rating) AS avg_rating
-    FROM ProductReviews
-    GROUP BY product_id
-) pr ON p.product_id = pr.product_id
-LEFT JOIN (
-    SELECT i.product_id, COUNT(oi.order_id) AS total_sales
-    FROM OrderItems oi
-    JOIN Inventory i ON oi.inventory_id = i.inventory_id
-    GROUP BY i.product_id
-) oi ON p.product_id = oi.product_id
-WHERE p.available = TRUE 
-  AND (LOWER(p.name) LIKE LOWER(:query) OR LOWER(p.description) LIKE LOWER(:query))
-ORDER BY p.name ASC
-''', query=search_term)
-        
+WHERE p.available = TRUE
+  AND p.search_vector @@ q.tsq
+ORDER BY {order_clause}
+LIMIT :limit OFFSET :offset
+''', query=query, limit=limit + 1, offset=(page - 1) * limit)
+
         products = []
-        for row in rows:
-            product = Product(*row[:7], row[8] if len(row) > 8 else 0, row[9] if len(row) > 9 else 0)
+        for row in rows[:limit]:
+            product = Product(*row[:7], row[8], row[9])
             product.seller_name = row[7]
-            product.seller_id = row[10] if len(row) > 10 else None
+            product.seller_id = row[10]
             products.append(product)
-        return products
+        return {
+            "products": products,
+            "terms": list(rows[0][11]) if rows else [],
+            "page": page,
+            "has_next": len(rows) > limit,
+            "limit": limit,
+        }
+
+    @staticmethod
+    @read_committed
+    def fuzzy_search(query, sort: str = "relevance", page: int = 1, limit: int = PAGE_SIZE):
+        """
+        Typo-tolerant name search: products whose name contains a word
+        trigram-similar to query (pg_trgm's <% operator, served by the GIN
+        trigram index on Products.name).  Matches below
+        SEARCH_SIMILARITY_THRESHOLD are dropped; "relevance" orders by
+        similarity.  Same return shape as search(); terms is always empty.
+        """
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        page = max(1, int(page))
+        if sort in KEYSET_SORTS:
+            sort_expr, sort_dir, _ = KEYSET_SORTS[sort]
+            order_clause = f"{sort_expr} {sort_dir}, p.product_id {sort_dir}"
+        else:
+            order_clause = "score DESC, p.product_id ASC"
+
+        # the threshold is a per-transaction setting, so it has to share a
+        # transaction with the query that uses it
+        with app.db.transaction() as conn:
+            conn.execute(text("SELECT set_config('pg_trgm.word_similarity_threshold', :threshold, true)"),
+                         {"threshold": str(app.config['SEARCH_SIMILARITY_THRESHOLD'])})
+            rows = conn.execute(text(f'''
+SELECT p.product_id, p.name, p.price, p.available, p.description, COALESCE(p.image, '') AS image, COALESCE(p.category, '') AS category,
+       COALESCE(u.firstname || ' ' || u.lastname, 'Unknown Seller') AS seller_name,
+       ps.avg_rating,
+       ps.units_sold AS total_sales, p.seller_id,
+       word_similarity(:query, p.name) AS score
+FROM Products p
+JOIN ProductStats ps ON p.product_id = ps.product_id
+LEFT JOIN Users u ON p.seller_id = u.id
+WHERE p.available = TRUE
+  AND :query <% p.name
+ORDER BY {order_clause}
+LIMIT :limit OFFSET :offset
+'''), {"query": query, "limit": limit + 1, "offset": (page - 1) * limit}).fetchall()
+
+        products = []
+        for row in rows[:limit]:
+            product = Product(*row[:7], row[8], row[9])
+            product.seller_name = row[7]
+            product.seller_id = row[10]
+            products.append(product)
+        return {
+            "products": products,
+            "terms": [],
+            "page": page,
+            "has_next": len(rows) > limit,
+            "limit": limit,
+        }
+
+    @staticmethod
+    @read_committed
+    def suggest_spelling(query):
+        """
+        "Did you mean" for a query with no full-text hits: the available
+        product name most trigram-similar to it, or None if nothing clears
+        SEARCH_SIMILARITY_THRESHOLD.
+        """
+        with app.db.transaction() as conn:
+            conn.execute(text("SELECT set_config('pg_trgm.word_similarity_threshold', :threshold, true)"),
+                         {"threshold": str(app.config['SEARCH_SIMILARITY_THRESHOLD'])})
+            rows = conn.execute(text('''
+SELECT name
+FROM Products
+WHERE available = TRUE
+  AND :query <% name
+ORDER BY word_similarity(:query, name) DESC, similarity(:query, name) DESC
+LIMIT 1
+'''), {"query": query}).fetchall()
+        return rows[0][0] if rows else None
 
     @staticmethod
     def update(product_id, name, description=None, category=None, image=None):
@@ -147,4 +750,5 @@ ORDER BY p.name ASC
             SET name = :name, description = :description, category = :category, image = :image
             WHERE product_id = :product_id
         ''', product_id=product_id, name=name, description=description, category=category, image=image)
+        app.cache_bus.publish('product', product_id)
         return True
@@ -0,0 +1,70 @@
+from flask import current_app as app
+
+
+class ProductStats:
+    """
+    Precomputed per-product aggregates (review count, rating sum/average,
+    units sold) kept in the ProductStats table so browse and search don't
+    have to GROUP BY ProductReviews and OrderItems on every request.
+    """
+
+    @staticmethod
+    def refresh_reviews(product_id):
+        """Recompute the review aggregates for one product (after an upsert/delete)."""
+        app.db.execute('''
+INSERT INTO ProductStats (product_id, review_count, rating_sum)
+SELECT :product_id, COUNT(*), COALESCE(SUM(rating), 0)
+FROM ProductReviews
+WHERE product_id = :product_id
+ON CONFLICT (product_id)
+DO UPDATE SET review_count = EXCLUDED.review_count,
+              rating_sum = EXCLUDED.rating_sum
+''', product_id=product_id)
+        app.cache_bus.publish('reviews', product_id)
+
+    @staticmethod
+    def record_sales(sales):
+        """Add sold units; sales is a list of (product_id, quantity) pairs."""
+        if not sales:
+            return
+        product_ids = [int(pid) for pid, _ in sales]
+        quantities = [int(qty) for _, qty in sales]
+        app.db.execute('''
+INSERT INTO ProductStats (product_id, units_sold)
+SELECT s.product_id, SUM(s.quantity)
+FROM unnest(CAST(:product_ids AS INT[]), CAST(:quantities AS INT[])) AS s(product_id, quantity)
+GROUP BY s.product_id
+ON CONFLICT (product_id)
+DO UPDATE SET units_sold = ProductStats.units_sold + EXCLUDED.units_sold
+''', product_ids=product_ids, quantities=quantities)
+
+    @staticmethod
+    def rebuild():
+        """Recompute every row from the base tables (fixes any drift). Returns rows written."""
+        return app.db.execute(REBUILD_SQL)
+
+
+# db/load.sql seeds the table with the same query after a fresh load.
+REBUILD_SQL = '''
+INSERT INTO ProductStats (product_id, review_count, rating_sum, units_sold)
+SELECT p.product_id,
+       COALESCE(r.review_count, 0),
+       COALESCE(r.rating_sum, 0),
+       COALESCE(s.units_sold, 0)
+FROM Products p
+LEFT JOIN (
+    SELECT product_id, COUNT(*) AS review_count, SUM(rating) AS rating_sum
+    FROM ProductReviews
+    GROUP BY product_id
+) r ON r.product_id = p.product_id
+LEFT JOIN (
+    SELECT i.product_id, SUM(oi.quantity_required) AS units_sold
+    FROM OrderItems oi
+    JOIN Inventory i ON oi.inventory_id = i.inventory_id
+    GROUP BY i.product_id
+) s ON s.product_id = p.product_id
+ON CONFLICT (product_id)
+DO UPDATE SET review_count = EXCLUDED.review_count,
+              rating_sum = EXCLUDED.rating_sum,
+              units_sold = EXCLUDED.units_sold
+'''
@@ -1,5 +1,7 @@
 from flask import current_app as app
 from datetime import datetime
+from .product_stats import ProductStats
+from ..db import read_committed
 
 class ProductReview:
     def __init__(self, review_id, product_id, user_id, rating, feedback, created_at):
@@ -12,6 +14,7 @@ class ProductReview:
         self.created_at = created_at
 
     @staticmethod
+    @read_committed
     def get_by_product(product_id, user_id=None):
         """Get all reviews for a product with user info, upvotes, and images - ordered by helpfulness"""
         from .messaging import ReviewUpvote, ReviewImage
@@ -55,6 +58,7 @@ class ProductReview:
         return reviews
 
     @staticmethod
+    @read_committed
     def get_average_rating(product_id):
         """Get average rating for a product"""
         rows = app.db.execute('''
@@ -75,6 +79,7 @@ INSERT INTO ProductReviews (product_id, user_id, rating, feedback, created_at)
 VALUES (:product_id, :user_id, :rating, :feedback, (current_timestamp AT TIME ZONE 'UTC'))
 RETURNING review_id
 ''', product_id=product_id, user_id=user_id, rating=rating, feedback=feedback)
+        ProductStats.refresh_reviews(product_id)
         return rows[0][0] if rows else None
     
 class ReviewRow:
@@ -88,6 +93,7 @@ class ReviewRow:
 
 class Review:
     @staticmethod
+    @read_committed
     def get_recent_by_user(uid, limit=5, kind=None, sort="date"):
         parts = []
         if kind in (None, "product"):
@@ -0,0 +1,163 @@
+import re
+import threading
+from bisect import bisect_left, insort
+
+from flask import current_app as app
+
+from ..db import read_committed
+
+
+# positions where a word starts: the beginning of the name or after a non-word character
+WORD_START = re.compile(r'(?:^|(?<=\W))\w')
+
+
+class SuggestIndex:
+    """
+    In-process prefix index for search-as-you-type.
+
+    Holds a sorted list of (key, product_id) where key is the lower-cased
+    product name from each word start onward, so "sony wh-1000xm4 headphones"
+    is found by "sony", "wh" and "head".  A lookup is a bisect plus a short
+    forward scan, so /api/search/suggest never touches the database.
+
+    The index is loaded from Products when the app is created and kept
+    current through refresh(), which app.cache_bus calls for every 'product'
+    write in any worker.  Products written while a build is reading are
+    remembered and reloaded once it is in place, so they aren't lost to the
+    swap.  One instance lives on the app (app.suggest_index).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._built = False
+        self._pending = None     # product_ids written during a build; None when not building
+        self._keys = []          # sorted (key, product_id)
+        self._products = {}      # product_id -> (name, category)
+        self._categories = []    # sorted (lower-cased category, category)
+        self._category_counts = {}
+
+    @read_committed
+    def build(self):
+        with self._lock:
+            if self._pending is None:
+                self._pending = set()
+        rows = app.db.execute('''
+SELECT product_id, name, COALESCE(category, '')
+FROM Products
+WHERE available = TRUE
+''')
+        with self._lock:
+            self._keys = []
+            self._products = {}
+            self._categories = []
+            self._category_counts = {}
+            for product_id, name, category in rows:
+                self._add(product_id, name, category)
+            self._keys.sort()
+            self._built = True
+            pending, self._pending = self._pending or (), None
+        # the rows above may predate these writes; read them again
+        for product_id in pending:
+            self.refresh(product_id)
+
+    def add_product(self, product_id, name, category=None, available=True):
+        """Insert or replace one product; remembered for later while a build is reading."""
+        with self._lock:
+            if self._pending is not None:
+                self._pending.add(product_id)
+            if not self._built:
+                return
+            self._remove(product_id)
+            if available:
+                self._add(product_id, name, category or '', keep_sorted=True)
+
+    def refresh(self, product_id=None):
+        """Reload one product from Products (everything for None)."""
+        if product_id is None:
+            self.build()
+            return
+        with self._lock:
+            if not self._built:
+                if self._pending is not None:
+                    self._pending.add(product_id)
+                return
+        rows = app.db.execute('''
+SELECT name, COALESCE(category, ''), available
+FROM Products
+WHERE product_id = :product_id
+''', product_id=product_id)
+        if rows:
+            self.add_product(product_id, *rows[0])
+        else:
+            with self._lock:
+                self._remove(product_id)
+
+    def suggest(self, prefix, limit=8):
+        """Return {'products': [{product_id, name}], 'categories': [...]} for prefix."""
+        if not self._built:
+            self.build()
+        prefix = prefix.strip().lower()
+        if not prefix:
+            return {'products': [], 'categories': []}
+
+        with self._lock:
+            products = []
+            seen = set()
+            i = bisect_left(self._keys, (prefix,))
+            while i < len(self._keys) and len(products) < limit:
+                key, product_id = self._keys[i]
+                if not key.startswith(prefix):
+                    break
+                if product_id not in seen:
+                    seen.add(product_id)
+                    products.append({'product_id': product_id, 'name': self._products[product_id][0]})
+                i += 1
+
+            categories = []
+            i = bisect_left(self._categories, (prefix,))
+            while i < len(self._categories) and len(categories) < limit:
+                key, category = self._categories[i]
+                if not key.startswith(prefix):
+                    break
+                categories.append(category)
+                i += 1
+        return {'products': products, 'categories': categories}
+
+    # --- internals (caller holds the lock) -----------------------------------
+
+    def _add(self, product_id, name, category, keep_sorted=False):
+        lowered = name.lower()
+        self._products[product_id] = (name, category)
+        for m in WORD_START.finditer(lowered):
+            entry = (lowered[m.start():], product_id)
+            if keep_sorted:
+                insort(self._keys, entry)
+            else:
+                self._keys.append(entry)
+        if category:
+            count = self._category_counts.get(category, 0)
+            self._category_counts[category] = count + 1
+            if count == 0:
+                insort(self._categories, (category.lower(), category))
+
+    def _remove(self, product_id):
+        old = self._products.pop(product_id, None)
+        if old is None:
+            return
+        name, category = old
+        lowered = name.lower()
+        for m in WORD_START.finditer(lowered):
+            entry = (lowered[m.start():], product_id)
+            i = bisect_left(self._keys, entry)
+            if i < len(self._keys) and self._keys[i] == entry:
+                del self._keys[i]
+        if category:
+            count = self._category_counts.get(category, 0) - 1
+            if count > 0:
+                self._category_counts[category] = count
+            else:
+                self._category_counts.pop(category, None)
+                entry = (category.lower(), category)
+                i = bisect_left(self._categories, entry)
+                if i < len(self._categories) and self._categories[i] == entry:
+                    del self._categories[i]
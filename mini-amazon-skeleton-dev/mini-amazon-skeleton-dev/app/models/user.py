@@ -1,9 +1,77 @@
+import threading
+import time
+from collections import OrderedDict
+
 from flask_login import UserMixin
 from flask import current_app as app
-from werkzeug.security import generate_password_hash, check_password_hash
+
+from ..db import read_committed, transactional
 
 from .. import login  # your LoginManager
 
+
+class UserCache:
+    """
+    Process-local LRU of Users rows for login.user_loader, so an
+    authenticated request doesn't pay a query just to rebuild current_user.
+
+    Holds the row tuples (each lookup builds a fresh User, so a route
+    changing current_user can't leak into other requests).  update_profile,
+    update_password, update_balance and order payments publish 'users' on
+    app.cache_bus, which drops that user in this process, and in every other
+    process only when CACHE_BUS_ENABLED is set.  Without the bus, a
+    deployment with several web workers or order_worker.py shows another
+    process's change (a queued order's payment, say) only once the entry
+    expires after USER_CACHE_TTL seconds.  Pages that act on the balance
+    read it fresh (User.get_balance).  A TTL of 0 turns the cache off.
+
+    The ttl/size settings are constructor arguments so other per-user
+    values can use the same cache (the analytics in app/users.py).
+    """
+
+    def __init__(self, ttl_setting='USER_CACHE_TTL', size_setting='USER_CACHE_SIZE'):
+        self.ttl_setting = ttl_setting
+        self.size_setting = size_setting
+        self._lock = threading.Lock()
+        self.version = 0
+        self._lru = OrderedDict()   # user_id -> (expires, row)
+
+    def ttl(self):
+        return app.config[self.ttl_setting]
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._lru.get(user_id)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._lru[user_id]
+                return None
+            self._lru.move_to_end(user_id)
+            return entry[1]
+
+    def put(self, user_id, row, version):
+        with self._lock:
+            # an invalidation that landed while the row was being read makes it stale
+            if version != self.version:
+                return
+            self._lru[user_id] = (time.monotonic() + self.ttl(), row)
+            self._lru.move_to_end(user_id)
+            while len(self._lru) > app.config[self.size_setting]:
+                self._lru.popitem(last=False)
+
+    def invalidate(self, user_id=None):
+        """Drop one user, or everyone when user_id is None."""
+        with self._lock:
+            self.version += 1
+            if user_id is None:
+                self._lru.clear()
+            else:
+                self._lru.pop(int(user_id), None)
+
+
+user_cache = UserCache()
+
 class User(UserMixin):
     def __init__(self, id, email, firstname, lastname, balance, address=None):
         self.id = id
@@ -24,8 +92,16 @@ class User(UserMixin):
         if not rows:  # email not found
             return None
         # rows[0] = (password_hash, id, email, firstname, lastname, balance, address)
-        if not check_password_hash(rows[0][0], password):
+        pwhash = rows[0][0]
+        if not app.passwords.verify(pwhash, password):
             return None
+        if app.passwords.needs_rehash(pwhash):
+            # made with older parameters; upgrade it while we have the password
+            app.db.execute("""
+                UPDATE Users
+                SET password = :new_hash
+                WHERE id = :user_id AND password = :old_hash
+            """, new_hash=app.passwords.hash(password), user_id=rows[0][1], old_hash=pwhash)
         return User(*(rows[0][1:]))
 
     @staticmethod
@@ -39,6 +115,7 @@ class User(UserMixin):
 
     @staticmethod
     def register(email, password, firstname, lastname, address):
+        pwhash = app.passwords.hash(password)
         try:
             rows = app.db.execute("""
                 INSERT INTO Users(email, password, firstname, lastname, address)
@@ -46,7 +123,7 @@ class User(UserMixin):
                 RETURNING id
             """,
             email=email,
-            password=generate_password_hash(password),
+            password=pwhash,
             firstname=firstname, lastname=lastname, address=address)
             new_id = rows[0][0]
             return User.get(new_id)
@@ -57,13 +134,23 @@ class User(UserMixin):
     @staticmethod
     @login.user_loader
     def get(id):
-        rows = app.db.execute("""
-            SELECT id, email, firstname, lastname, balance, address
-            FROM Users
-            WHERE id = :id
-        """, id=id)
-        # rows[0] = (id, email, firstname, lastname, balance, address)
-        return User(*(rows[0])) if rows else None
+        id = int(id)  # the user_loader passes the session's string id
+        ttl = user_cache.ttl()
+        row = user_cache.get(id) if ttl > 0 else None
+        if row is None:
+            version = user_cache.version
+            rows = app.db.execute("""
+                SELECT id, email, firstname, lastname, balance, address
+                FROM Users
+                WHERE id = :id
+            """, id=id)
+            if not rows:
+                return None
+            # rows[0] = (id, email, firstname, lastname, balance, address)
+            row = tuple(rows[0])
+            if ttl > 0:
+                user_cache.put(id, row, version)
+        return User(*row)
 
     @staticmethod
     def email_exists_except_user(email, user_id):
@@ -90,6 +177,7 @@ class User(UserMixin):
                 address=address, user_id=user_id)
             
             print(f"DEBUG: Update result: {result}")
+            app.cache_bus.publish('users', user_id)
             return True
         except Exception as e:
             print(f"DEBUG: Error updating profile: {str(e)}")
@@ -98,12 +186,14 @@ class User(UserMixin):
     @staticmethod
     def update_password(user_id, new_password):
         """Update user password"""
+        pwhash = app.passwords.hash(new_password)
         try:
             app.db.execute("""
                 UPDATE Users
                 SET password = :password
                 WHERE id = :user_id
-            """, password=generate_password_hash(new_password), user_id=user_id)
+            """, password=pwhash, user_id=user_id)
+            app.cache_bus.publish('users', user_id)
             return True
         except Exception as e:
             print(str(e))
@@ -120,38 +210,60 @@ class User(UserMixin):
         
         if not rows:
             return False
-        return check_password_hash(rows[0][0], password)
+        return app.passwords.verify(rows[0][0], password)
 
     @staticmethod
-    def update_balance(user_id, amount):
-        """Update user balance (positive for top-up, negative for withdrawal)"""
-        try:
-            # First check current balance
-            current_rows = app.db.execute("""
-                SELECT balance FROM Users WHERE id = :user_id
-            """, user_id=user_id)
-            
-            if not current_rows:
-                return False, "User not found"
-            
-            current_balance = float(current_rows[0][0])
-            new_balance = current_balance + amount
-            
-            # Check if withdrawal would result in negative balance
-            if new_balance < 0:
-                return False, "Insufficient funds"
-            
-            # Update balance
-            app.db.execute("""
+    @read_committed
+    @transactional
+    def update_balance(user_id, amount, kind=None, order_id=None):
+        """
+        Add amount to the user's balance (negative for a withdrawal or an
+        order payment) and append the BalanceLedger entry, in one statement.
+        kind defaults to 'topup' / 'withdrawal' by sign.
+        Returns (True, new_balance) or (False, reason).
+
+        READ COMMITTED is enough because the work is that one statement.
+        An UPDATE that waits on a concurrent change to the row re-checks its
+        WHERE against the committed new version, so the "balance + delta
+        >= 0" guard always sees the latest balance and two payments can't
+        overdraw it.  The ledger entry is written from the same
+        statement's RETURNING.  SERIALIZABLE would only add retries.
+        Inside a bigger transaction (Order.process_jobs) this joins that
+        transaction's isolation.
+        """
+        if kind is None:
+            kind = 'topup' if amount > 0 else 'withdrawal'
+        # the guarded UPDATE matches no row rather than overdraw, so two
+        # concurrent payments can't both spend the same money
+        rows = app.db.execute("""
+            WITH debit AS (
                 UPDATE Users
-                SET balance = :new_balance
-                WHERE id = :user_id
-            """, new_balance=new_balance, user_id=user_id)
-            
-            return True, new_balance
-        except Exception as e:
-            print(f"DEBUG: Error updating balance: {str(e)}")
-            return False, str(e)
+                SET balance = balance + CAST(:delta AS DECIMAL(12,2))
+                WHERE id = :user_id AND balance + CAST(:delta AS DECIMAL(12,2)) >= 0
+                RETURNING balance
+            )
+            INSERT INTO BalanceLedger (user_id, amount, kind, order_id, balance_after)
+            SELECT :user_id, CAST(:delta AS DECIMAL(12,2)), :kind, :order_id, balance
+            FROM debit
+            RETURNING balance_after
+        """, user_id=user_id, delta=amount, kind=kind, order_id=order_id)
+        if rows:
+            app.cache_bus.publish('users', user_id)
+            return True, float(rows[0][0])
+        if not app.db.execute("SELECT 1 FROM Users WHERE id = :user_id", user_id=user_id):
+            return False, "User not found"
+        return False, "Insufficient funds"
+
+    @staticmethod
+    @read_committed
+    def get_balance(user_id):
+        """Balance straight from Users; current_user's may be USER_CACHE_TTL seconds old."""
+        rows = app.db.execute("""
+            SELECT balance
+            FROM Users
+            WHERE id = :user_id
+        """, user_id=user_id)
+        return rows[0][0] if rows else None
 
     @staticmethod
     def get_public_info(user_id):
@@ -89,11 +89,12 @@ def order_detail(order_id: int):
 
     # header
     hdr_rows = current_app.db.execute(
-        f"""
+        """
         SELECT order_id, user_id, time_ordered, total_price, status
         FROM Orders
-        WHERE order_id = {oid}
-        """
+        WHERE order_id = :order_id
+        """,
+        order_id=oid
     )
     if not hdr_rows:
         abort(404)
@@ -104,7 +105,7 @@ def order_detail(order_id: int):
 
     # items
     item_rows = current_app.db.execute(
-        f"""
+        """
         SELECT
             oi.order_item_id,
             p.product_id,
@@ -116,9 +117,10 @@ def order_detail(order_id: int):
         FROM OrderItems oi
         JOIN Inventory i ON i.inventory_id = oi.inventory_id
         JOIN Products  p ON p.product_id = i.product_id
-        WHERE oi.order_id = {oid}
+        WHERE oi.order_id = :order_id
         ORDER BY oi.order_item_id
-        """
+        """,
+        order_id=oid
     )
 
     items = []
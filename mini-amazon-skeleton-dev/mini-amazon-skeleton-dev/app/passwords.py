@@ -0,0 +1,98 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class PasswordHasherBusy(Exception):
+    """Every hashing slot stayed taken for PASSWORD_HASH_WAIT_SECONDS."""
+
+
+class PasswordHasher:
+    """
+    Password hashing and checking off the request thread.
+
+    A password hash is slow on purpose (pbkdf2:sha256 at 600000 iterations
+    is about half a second of CPU), so a burst of logins done inline would
+    take every web worker away from browse traffic.  Here the work runs in a
+    pool of PASSWORD_HASH_WORKERS processes, and at most PASSWORD_HASH_QUEUE
+    calls per web worker may be running or waiting for it.  A call that
+    can't get a slot within PASSWORD_HASH_WAIT_SECONDS raises
+    PasswordHasherBusy (answered with a 503) instead of queueing forever.
+    PASSWORD_HASH_WORKERS = 0 hashes on the request thread.
+
+    New hashes use PASSWORD_HASH_METHOD, a werkzeug method string with every
+    parameter spelled out ('pbkdf2:sha256:600000', 'scrypt:32768:8:1');
+    needs_rehash() spots stored hashes made with anything else, which
+    User.get_by_auth upgrades on the next successful login.
+
+    One instance lives on the app (app.passwords).
+    """
+
+    def __init__(self, app):
+        self.method = app.config['PASSWORD_HASH_METHOD']
+        self.workers = app.config['PASSWORD_HASH_WORKERS']
+        self.wait = app.config['PASSWORD_HASH_WAIT_SECONDS']
+        self._slots = threading.BoundedSemaphore(app.config['PASSWORD_HASH_QUEUE'])
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pool_pid = None
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, pwhash, password):
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        # werkzeug stores "<method>$<salt>$<hash>"
+        return pwhash.split('$', 1)[0] != self.method
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(timeout=self.wait):
+            raise PasswordHasherBusy()
+        try:
+            if self.workers <= 0:
+                return fn(*args)
+            pool = self._executor()
+            try:
+                return pool.submit(fn, *args).result()
+            except BrokenProcessPool:
+                # a child died (OOM killer, a crash) and took the pool with
+                # it; every later call would fail too, so start a new one
+                self._discard(pool)
+                return self._executor().submit(fn, *args).result()
+        finally:
+            self._slots.release()
+
+    def _executor(self):
+        # one pool per process: a forked web worker can't use its parent's
+        if self._pool_pid != os.getpid():
+            with self._lock:
+                if self._pool_pid != os.getpid():
+                    # Forked, because spawn / forkserver would re-run the
+                    # __main__ script (amazon.py builds the whole app).  The
+                    # web worker may already run threads (request threads,
+                    # the cache bus listener, the hold sweeper), and a fork
+                    # only copies the calling one; anything another thread
+                    # held locked at that moment stays locked in the child.
+                    # The children here never reach such state: they only
+                    # loop on the executor's call queue running werkzeug's
+                    # hash functions (hashlib, already imported), with no
+                    # logging, database connections or imports, and CPython
+                    # resets the GIL, import and threading locks after fork.
+                    self._pool = ProcessPoolExecutor(self.workers,
+                                                     mp_context=multiprocessing.get_context('fork'))
+                    self._pool_pid = os.getpid()
+        return self._pool
+
+    def _discard(self, broken):
+        with self._lock:
+            # another thread may have replaced it already
+            if self._pool is broken:
+                broken.shutdown(wait=False)
+                self._pool = None
+                self._pool_pid = None
@@ -9,6 +9,7 @@ from werkzeug.utils import secure_filename
 from app.models.review import Review
 from app.models.messaging import ReviewUpvote, ReviewImage
 from app.models.social import Notification
+from app.models.product_stats import ProductStats
 
 bp = Blueprint("reviews", __name__)
 
@@ -79,6 +80,7 @@ def new_product_review(product_id: int):
             rating=rating,
             feedback=feedback,
         )
+        ProductStats.refresh_reviews(product_id)
         
         # Handle image uploads
         if result and 'files' in request.files:
@@ -257,6 +259,7 @@ def delete_product_review(product_id: int):
         pid=product_id,
         uid=current_user.id,
     )
+    ProductStats.refresh_reviews(product_id)
     flash("Your product review was deleted.", "success")
     return redirect(url_for("reviews.my_reviews"))
 
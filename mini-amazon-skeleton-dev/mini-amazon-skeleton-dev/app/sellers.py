@@ -3,6 +3,7 @@ from flask import Blueprint, render_template, redirect, url_for, request, curren
 from flask_login import login_required, current_user
 from .models.inventory import Inventory
 from .models.product import Product
+from .db import read_only, request_connection
 
 bp = Blueprint('seller', __name__, url_prefix='/seller')
 
@@ -282,6 +283,8 @@ def fulfill_item(order_item_id):
     flash('Item marked as fulfilled!', 'success')
     return redirect(request.referrer or url_for('seller.orders'))
 @bp.route('/public/<int:seller_id>')
+@read_only
+@request_connection
 def public_seller_page(seller_id):
     """
     Public-facing seller page showing seller info and their products.
@@ -1,4 +1,9 @@
-from flask import render_template, redirect, url_for, flash, request, current_app
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+from flask import render_template, redirect, url_for, flash, request, current_app, jsonify, copy_current_request_context
 from werkzeug.urls import url_parse
 from flask_login import login_user, logout_user, current_user
 from flask_wtf import FlaskForm
@@ -8,9 +13,11 @@ from flask_login import login_required, current_user
 from flask import render_template
 from .models.purchase import Purchase
 
-from .models.user import User
+from .models.user import User, UserCache
+from .db import read_only
 
 
+@read_only
 def get_user_order_summaries(user_id):
     """Get order summaries for a user with total amount, item count, and status"""
     try:
@@ -46,112 +53,159 @@ def get_user_order_summaries(user_id):
         return []
 
 
+@read_only
 def get_balance_history(user_id):
-    """Get balance history for visualization (simplified version)"""
-    try:
-        # For now, just return current balance as a single point
-        # In a real implementation, you'd have a balance_history table
-        user = User.get(user_id)
-        if user:
-            return [{'date': '2024-01-01', 'balance': float(user.balance)}]
-        return []
-    except Exception as e:
-        print(f"DEBUG: Error getting balance history: {str(e)}")
-        return []
+    """Balance after each BalanceLedger entry, oldest first, for visualization"""
+    rows = current_app.db.execute("""
+        SELECT created_at, amount, balance_after
+        FROM BalanceLedger
+        WHERE user_id = :user_id
+        ORDER BY entry_id
+    """, user_id=user_id)
+    if not rows:
+        # no top-ups, withdrawals or payments yet: just the current balance
+        balance = User.get_balance(user_id)
+        if balance is None:
+            return []
+        return [{'date': date.today().isoformat(), 'balance': float(balance)}]
+
+    # start from the balance before the first entry (e.g. from a data load)
+    first_date, first_amount, first_after = rows[0]
+    history = [{'date': first_date.date().isoformat(), 'balance': float(first_after - first_amount)}]
+    for created_at, amount, balance_after in rows:
+        history.append({'date': created_at.date().isoformat(), 'balance': float(balance_after)})
+    return history
 
 
+@read_only
 def get_spending_by_category(user_id):
     """Get spending breakdown by product category"""
-    try:
-        # First, let's see what order statuses exist
-        debug_rows = current_app.db.execute("""
-            SELECT DISTINCT status FROM Orders WHERE user_id = :user_id
-        """, user_id=user_id)
-        print(f"DEBUG: Available order statuses for user {user_id}: {[row[0] for row in debug_rows]}")
-        
-        rows = current_app.db.execute("""
-            SELECT p.category, SUM(oi.final_unit_price * oi.quantity_required) as total_spent
-            FROM Orders o
-            JOIN OrderItems oi ON o.order_id = oi.order_id
-            JOIN Inventory i ON oi.inventory_id = i.inventory_id
-            JOIN Products p ON i.product_id = p.product_id
-            WHERE o.user_id = :user_id
-            GROUP BY p.category
-            ORDER BY total_spent DESC
-        """, user_id=user_id)
-        
-        categories = []
-        for row in rows:
-            categories.append({
-                'category': row[0] or 'Uncategorized',
-                'amount': float(row[1])
-            })
-        
-        return categories
-    except Exception as e:
-        print(f"DEBUG: Error getting spending by category: {str(e)}")
-        return []
+    rows = current_app.db.execute("""
+        SELECT p.category, SUM(oi.final_unit_price * oi.quantity_required) as total_spent
+        FROM Orders o
+        JOIN OrderItems oi ON o.order_id = oi.order_id
+        JOIN Inventory i ON oi.inventory_id = i.inventory_id
+        JOIN Products p ON i.product_id = p.product_id
+        WHERE o.user_id = :user_id
+        GROUP BY p.category
+        ORDER BY total_spent DESC
+    """, user_id=user_id)
 
+    categories = []
+    for row in rows:
+        categories.append({
+            'category': row[0] or 'Uncategorized',
+            'amount': float(row[1])
+        })
 
-def get_monthly_spending(user_id):
-    """Get monthly spending trends"""
-    try:
-        rows = current_app.db.execute("""
-            SELECT 
-                DATE_TRUNC('month', o.time_ordered) as month,
-                SUM(o.total_price) as total_spent,
-                COUNT(o.order_id) as order_count
-            FROM Orders o
-            WHERE o.user_id = :user_id
-            GROUP BY DATE_TRUNC('month', o.time_ordered)
-            ORDER BY month DESC
-            LIMIT 12
-        """, user_id=user_id)
-        
-        monthly_data = []
-        for row in rows:
-            monthly_data.append({
-                'month': row[0].strftime('%Y-%m') if row[0] else 'Unknown',
-                'amount': float(row[1]),
-                'order_count': row[2]
-            })
-        
-        return monthly_data
-    except Exception as e:
-        print(f"DEBUG: Error getting monthly spending: {str(e)}")
-        return []
+    return categories
 
 
+@read_only
+def get_monthly_spending(user_id):
+    """Get monthly spending trends"""
+    rows = current_app.db.execute("""
+        SELECT 
+            DATE_TRUNC('month', o.time_ordered) as month,
+            SUM(o.total_price) as total_spent,
+            COUNT(o.order_id) as order_count
+        FROM Orders o
+        WHERE o.user_id = :user_id
+        GROUP BY DATE_TRUNC('month', o.time_ordered)
+        ORDER BY month DESC
+        LIMIT 12
+    """, user_id=user_id)
+
+    monthly_data = []
+    for row in rows:
+        monthly_data.append({
+            'month': row[0].strftime('%Y-%m') if row[0] else 'Unknown',
+            'amount': float(row[1]),
+            'order_count': row[2]
+        })
+
+    return monthly_data
+
+
+@read_only
 def get_top_sellers(user_id):
     """Get top sellers by spending amount"""
-    try:
-        rows = current_app.db.execute("""
-            SELECT 
-                u.firstname || ' ' || u.lastname as seller_name,
-                SUM(oi.final_unit_price * oi.quantity_required) as total_spent,
-                COUNT(DISTINCT o.order_id) as order_count
-            FROM Orders o
-            JOIN OrderItems oi ON o.order_id = oi.order_id
-            JOIN Inventory i ON oi.inventory_id = i.inventory_id
-            JOIN Users u ON i.user_id = u.id
-            WHERE o.user_id = :user_id
-            GROUP BY u.id, u.firstname, u.lastname
-            ORDER BY total_spent DESC
-            LIMIT 5
-        """, user_id=user_id)
-        
-        sellers = []
-        for row in rows:
-            sellers.append({
-                'name': row[0],
-                'amount': float(row[1]),
-                'order_count': row[2]
-            })
-        
-        return sellers
-    except Exception as e:
-        print(f"DEBUG: Error getting top sellers: {str(e)}")
-        return []
+    rows = current_app.db.execute("""
+        SELECT 
+            u.firstname || ' ' || u.lastname as seller_name,
+            SUM(oi.final_unit_price * oi.quantity_required) as total_spent,
+            COUNT(DISTINCT o.order_id) as order_count
+        FROM Orders o
+        JOIN OrderItems oi ON o.order_id = oi.order_id
+        JOIN Inventory i ON oi.inventory_id = i.inventory_id
+        JOIN Users u ON i.user_id = u.id
+        WHERE o.user_id = :user_id
+        GROUP BY u.id, u.firstname, u.lastname
+        ORDER BY total_spent DESC
+        LIMIT 5
+    """, user_id=user_id)
+
+    sellers = []
+    for row in rows:
+        sellers.append({
+            'name': row[0],
+            'amount': float(row[1]),
+            'order_count': row[2]
+        })
+
+    return sellers
+
+
+# per-user results of get_user_analytics; see UserCache
+analytics_cache = UserCache('ANALYTICS_CACHE_TTL', 'ANALYTICS_CACHE_SIZE')
+
+ANALYTICS = {
+    'balance_history': get_balance_history,
+    'spending_by_category': get_spending_by_category,
+    'monthly_spending': get_monthly_spending,
+    'top_sellers': get_top_sellers,
+}
+
+# one pool of ANALYTICS_WORKERS threads per process, shared by every request
+# (see _analytics_executor)
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def _analytics_executor():
+    global _executor, _executor_pid
+    # a forked worker doesn't get its parent's threads
+    if _executor_pid != os.getpid():
+        with _executor_lock:
+            if _executor_pid != os.getpid():
+                _executor = ThreadPoolExecutor(max_workers=current_app.config['ANALYTICS_WORKERS'],
+                                               thread_name_prefix='analytics')
+                _executor_pid = os.getpid()
+    return _executor
+
+
+def get_user_analytics(user_id):
+    """
+    All the analytics for a user, as a dict keyed like ANALYTICS.  The
+    queries run side by side on a thread pool shared by the whole process,
+    each on its own connection (a copy of the request context gets its own
+    g).  The pool has ANALYTICS_WORKERS threads, so however many analytics
+    requests arrive at once, they hold at most that many pooled connections.
+    The result is cached until the user orders or their balance changes.
+    If any query fails the exception is raised and nothing is cached.
+    """
+    cached = analytics_cache.get(user_id) if analytics_cache.ttl() > 0 else None
+    if cached is not None:
+        return cached
+    version = analytics_cache.version
+    pool = _analytics_executor()
+    futures = {name: pool.submit(copy_current_request_context(fn), user_id)
+               for name, fn in ANALYTICS.items()}
+    result = {name: future.result() for name, future in futures.items()}
+    if analytics_cache.ttl() > 0:
+        analytics_cache.put(user_id, result, version)
+    return result
 
 
 from flask import Blueprint
@@ -225,44 +279,21 @@ def logout():
 @bp.route('/profile')
 @login_required
 def profile():
-    try:
-        # Get analytics data
-        balance_data = get_balance_history(current_user.id)
-        spending_by_category = get_spending_by_category(current_user.id)
-        monthly_spending = get_monthly_spending(current_user.id)
-        top_sellers = get_top_sellers(current_user.id)
-        
-        return render_template('profile.html', user=current_user)
-    except Exception as e:
-        print(f"DEBUG: Error getting profile data: {str(e)}")
-        return render_template('profile.html', user=current_user)
+    return render_template('profile.html', user=current_user)
 
 
 @bp.route('/analytics')
 @login_required
 def analytics():
-    """Dedicated analytics page with spending insights"""
-    try:
-        # Get analytics data
-        balance_data = get_balance_history(current_user.id)
-        spending_by_category = get_spending_by_category(current_user.id)
-        monthly_spending = get_monthly_spending(current_user.id)
-        top_sellers = get_top_sellers(current_user.id)
-        
-        return render_template('analytics.html', 
-                             user=current_user,
-                             balance_data=balance_data,
-                             spending_by_category=spending_by_category,
-                             monthly_spending=monthly_spending,
-                             top_sellers=top_sellers)
-    except Exception as e:
-        print(f"DEBUG: Error getting analytics data: {str(e)}")
-        return render_template('analytics.html', 
-                             user=current_user,
-                             balance_data=[],
-                             spending_by_category=[],
-                             monthly_spending=[],
-                             top_sellers=[])
+    """Dedicated analytics page with spending insights (filled in from /api/analytics)"""
+    return render_template('analytics.html', user=current_user)
+
+
+@bp.route('/api/analytics')
+@login_required
+def analytics_api():
+    """The current user's spending analytics as JSON, for the analytics page"""
+    return jsonify(get_user_analytics(current_user.id))
 
 
 class EditProfileForm(FlaskForm):
@@ -619,56 +650,35 @@ def buy_again_order(order_id):
     """Add all available items from an order back to the cart"""
     from .models.cart import Cart
     
-    # Verify the order belongs to the current user
-    order_rows = current_app.db.execute("""
-        SELECT user_id FROM Orders WHERE order_id = :order_id
-    """, order_id=order_id)
-    
-    if not order_rows or order_rows[0][0] != current_user.id:
-        flash('Order not found or access denied')
-        return redirect(url_for('orders.orders_page'))
-    
-    # Get all items from the order with their original quantities
-    item_rows = current_app.db.execute("""
-        SELECT i.product_id, p.name, oi.quantity_required
-        FROM OrderItems oi
-        JOIN Inventory i ON oi.inventory_id = i.inventory_id
-        JOIN Products p ON i.product_id = p.product_id
-        WHERE oi.order_id = :order_id
-    """, order_id=order_id)
-    
-    if not item_rows:
-        flash('No items found in this order')
-        return redirect(url_for('orders.orders_page'))
-    
     # Ensure user has a cart
     cart_id = Cart.ensure_for_user(current_user.id)
-    
+
+    # One statement for the whole order: cheapest in-stock listing per
+    # product, added with the original quantity (or what's left of it)
+    lines = Cart.add_order_again(cart_id, order_id, current_user.id)
+
+    if not lines:
+        # Verify the order belongs to the current user
+        order_rows = current_app.db.execute("""
+            SELECT user_id FROM Orders WHERE order_id = :order_id
+        """, order_id=order_id)
+        if not order_rows or order_rows[0][0] != current_user.id:
+            flash('Order not found or access denied')
+        else:
+            flash('No items found in this order')
+        return redirect(url_for('orders.orders_page'))
+
     added_items = []
     unavailable_items = []
     partially_added_items = []
-    
-    # Try to add each product to cart with original quantity
-    for product_id, product_name, original_quantity in item_rows:
-        # Find available inventory for this product
-        inventory_rows = current_app.db.execute("""
-            SELECT inventory_id, quantity FROM Inventory
-            WHERE product_id = :product_id AND quantity > 0
-            ORDER BY price ASC
-            LIMIT 1
-        """, product_id=product_id)
-        
-        if inventory_rows:
-            inventory_id, available_quantity = inventory_rows[0]
-            actual_quantity = min(original_quantity, available_quantity)
-            Cart.add_item(cart_id, inventory_id, actual_quantity)
-            
-            if actual_quantity == original_quantity:
-                added_items.append(f"{product_name} (qty: {actual_quantity})")
-            else:
-                partially_added_items.append(f"{product_name} (qty: {actual_quantity}/{original_quantity})")
-        else:
+
+    for product_name, original_quantity, actual_quantity in lines:
+        if actual_quantity == 0:
             unavailable_items.append(product_name)
+        elif actual_quantity == original_quantity:
+            added_items.append(f"{product_name} (qty: {actual_quantity})")
+        else:
+            partially_added_items.append(f"{product_name} (qty: {actual_quantity}/{original_quantity})")
     
     # Create appropriate flash message
     total_added = len(added_items) + len(partially_added_items)
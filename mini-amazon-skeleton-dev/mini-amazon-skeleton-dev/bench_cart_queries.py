@@ -0,0 +1,107 @@
+# Measure the parse/plan time a cart page view spends in Postgres, with the
+# cart queries sent as literal SQL (ids pasted into the text, as the old
+# f-string code did) versus as one prepared statement reused per connection
+# Needs psycopg 3 (pip install "psycopg[binary]>=3.2"), the driver DB
+# prepares statements with:
+# Run this with: DB_DRIVER=postgresql+psycopg python bench_cart_queries.py [user_id] [iterations]
+
+import json
+import os
+import re
+import sys
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import psycopg
+from sqlalchemy import event
+
+from app import create_app
+from app.models.cart import Cart
+
+
+def capture_cart_page(app, user_id):
+    """
+    The (sql, params) of the reads a cart page runs (ensure_for_user,
+    get_contents); the cart upsert is left out so replaying doesn't write.
+    """
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            statements.append((statement, parameters))
+
+    event.listen(app.db.engine, 'before_cursor_execute', record)
+    try:
+        cart_id = Cart.ensure_for_user(user_id)
+        Cart.get_contents(cart_id)
+    finally:
+        event.remove(app.db.engine, 'before_cursor_execute', record)
+    return statements
+
+
+def planning_ms(cur, sql, params=None):
+    cur.execute('EXPLAIN (ANALYZE, SUMMARY, FORMAT JSON) ' + sql, params)
+    return cur.fetchone()[0][0]['Planning Time']
+
+
+def run_bench(user_id=2, iterations=200):
+    app = create_app()
+    if app.db.engine.dialect.driver != 'psycopg':
+        sys.exit('set DB_DRIVER=postgresql+psycopg: prepared statements need psycopg 3')
+    with app.app_context():
+        statements = capture_cart_page(app, user_id)
+        conn = app.db.engine.raw_connection()
+        try:
+            # parameters are interpolated client-side, as psycopg2 did: the
+            # literal text is what the old f-strings sent, and EXECUTE (a
+            # utility statement) can't take server-side parameters
+            cur = psycopg.ClientCursor(conn.driver_connection)
+
+            # literal: a new statement text every time, parsed and planned on every call
+            literal = [cur.mogrify(sql, params) for sql, params in statements]
+            plan_literal = 0.0
+            start = time.perf_counter()
+            for _ in range(iterations):
+                for sql in literal:
+                    cur.execute(sql)
+                    cur.fetchall()
+            wall_literal = time.perf_counter() - start
+            for _ in range(iterations):
+                plan_literal += sum(planning_ms(cur, sql) for sql in literal)
+
+            # bound: PREPARE once, then EXECUTE with the parameters
+            executes = []
+            for n, (sql, params) in enumerate(statements):
+                names = list(dict.fromkeys(re.findall(r'%\((\w+)\)s', sql)))
+                body = re.sub(r'%\((\w+)\)s', lambda m: f'${names.index(m.group(1)) + 1}', sql)
+                cur.execute(f'PREPARE bench_cart_{n} AS {body}')
+                args = ', '.join(['%s'] * len(names))
+                executes.append((f'EXECUTE bench_cart_{n}({args})', [params[k] for k in names]))
+            plan_bound = 0.0
+            start = time.perf_counter()
+            for _ in range(iterations):
+                for sql, args in executes:
+                    cur.execute(sql, args)
+                    cur.fetchall()
+            wall_bound = time.perf_counter() - start
+            for _ in range(iterations):
+                plan_bound += sum(planning_ms(cur, sql, args) for sql, args in executes)
+            conn.rollback()
+        finally:
+            conn.close()
+
+    per_view = {
+        'statements_per_view': len(statements),
+        'literal_planning_ms': round(plan_literal / iterations, 4),
+        'prepared_planning_ms': round(plan_bound / iterations, 4),
+        'literal_wall_ms': round(wall_literal * 1000 / iterations, 4),
+        'prepared_wall_ms': round(wall_bound * 1000 / iterations, 4),
+    }
+    print(f'Cart page view for user {user_id}, averaged over {iterations} views:')
+    print(json.dumps(per_view, indent=2))
+    saved = per_view['literal_wall_ms'] - per_view['prepared_wall_ms']
+    print(f'✓ Prepared statements save {saved:.3f} ms of database time per cart page view')
+
+
+if __name__ == '__main__':
+    run_bench(*(int(a) for a in sys.argv[1:3]))
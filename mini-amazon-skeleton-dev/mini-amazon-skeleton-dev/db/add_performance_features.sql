@@ -0,0 +1,128 @@
+-- Bring an existing database up to db/create.sql: search, browse and checkout
+-- tables and indexes added after the initial schema.  Every statement is
+-- idempotent, so this is safe to run again (python migrate.py).
+
+-- Full-text search document and its index (Product.search)
+ALTER TABLE Products ADD COLUMN IF NOT EXISTS search_vector TSVECTOR GENERATED ALWAYS AS (
+    setweight(to_tsvector('english', COALESCE(name, '')), 'A') ||
+    setweight(to_tsvector('english', COALESCE(category, '')), 'B') ||
+    setweight(to_tsvector('english', COALESCE(description, '')), 'C')
+) STORED;
+CREATE INDEX IF NOT EXISTS idx_products_search ON Products USING GIN (search_vector);
+
+-- Trigram matching for typo-tolerant product search
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX IF NOT EXISTS idx_products_name_trgm ON Products USING GIN (name gin_trgm_ops);
+
+-- Product Stats (precomputed browse/search aggregates, one row per product)
+CREATE TABLE IF NOT EXISTS ProductStats (
+    product_id   INT NOT NULL PRIMARY KEY REFERENCES Products(product_id) ON DELETE CASCADE,
+    review_count INT NOT NULL DEFAULT 0,
+    rating_sum   INT NOT NULL DEFAULT 0,
+    avg_rating   DECIMAL(3,2) GENERATED ALWAYS AS
+                 (CASE WHEN review_count > 0 THEN ROUND(rating_sum::DECIMAL / review_count, 2) ELSE 0 END) STORED,
+    units_sold   INT NOT NULL DEFAULT 0
+);
+
+-- Backfill it (same query as ProductStats.rebuild() / rebuild_product_stats.py)
+INSERT INTO ProductStats (product_id, review_count, rating_sum, units_sold)
+SELECT p.product_id,
+       COALESCE(r.review_count, 0),
+       COALESCE(r.rating_sum, 0),
+       COALESCE(s.units_sold, 0)
+FROM Products p
+LEFT JOIN (
+    SELECT product_id, COUNT(*) AS review_count, SUM(rating) AS rating_sum
+    FROM ProductReviews
+    GROUP BY product_id
+) r ON r.product_id = p.product_id
+LEFT JOIN (
+    SELECT i.product_id, SUM(oi.quantity_required) AS units_sold
+    FROM OrderItems oi
+    JOIN Inventory i ON oi.inventory_id = i.inventory_id
+    GROUP BY i.product_id
+) s ON s.product_id = p.product_id
+ON CONFLICT (product_id)
+DO UPDATE SET review_count = EXCLUDED.review_count,
+              rating_sum = EXCLUDED.rating_sum,
+              units_sold = EXCLUDED.units_sold;
+
+-- Browse keyset pagination: one (sort key, product_id) index per sort option
+CREATE INDEX IF NOT EXISTS idx_products_name_key ON Products(name, product_id);
+CREATE INDEX IF NOT EXISTS idx_products_price_key ON Products(price, product_id);
+CREATE INDEX IF NOT EXISTS idx_product_stats_rating_key ON ProductStats(avg_rating, product_id);
+CREATE INDEX IF NOT EXISTS idx_product_stats_sales_key ON ProductStats(units_sold, product_id);
+
+-- One cart line per listing (Cart.add_item upserts on it): merge existing
+-- duplicates into the oldest line first
+UPDATE CartItems c
+SET quantity_required = d.quantity_required
+FROM (
+    SELECT MIN(cart_item_id) AS cart_item_id, SUM(quantity_required) AS quantity_required
+    FROM CartItems
+    GROUP BY cart_id, inventory_id
+    HAVING COUNT(*) > 1
+) d
+WHERE c.cart_item_id = d.cart_item_id;
+DELETE FROM CartItems c
+USING CartItems d
+WHERE c.cart_id = d.cart_id
+  AND c.inventory_id = d.inventory_id
+  AND c.cart_item_id > d.cart_item_id;
+CREATE UNIQUE INDEX IF NOT EXISTS cart_items_unique ON CartItems(cart_id, inventory_id);
+
+-- Inventory holds: stock set aside for a cart while its buyer is in checkout,
+-- then for the order an async checkout queued
+CREATE TABLE IF NOT EXISTS InventoryHolds (
+    hold_id SERIAL PRIMARY KEY,
+    inventory_id INT NOT NULL REFERENCES Inventory(inventory_id) ON DELETE CASCADE,
+    cart_id INT NOT NULL REFERENCES Carts(cart_id) ON DELETE CASCADE,
+    order_id INT REFERENCES Orders(order_id) ON DELETE CASCADE,
+    quantity INT NOT NULL CHECK (quantity > 0),
+    expires_at TIMESTAMP WITHOUT TIME ZONE NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS inventory_holds_one_per_cart ON InventoryHolds(inventory_id, cart_id) WHERE order_id IS NULL;
+CREATE UNIQUE INDEX IF NOT EXISTS inventory_holds_one_per_order ON InventoryHolds(order_id, inventory_id) WHERE order_id IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_inventory_holds_active ON InventoryHolds(inventory_id, expires_at) INCLUDE (cart_id, order_id, quantity);
+CREATE INDEX IF NOT EXISTS idx_inventory_holds_cart ON InventoryHolds(cart_id);
+CREATE INDEX IF NOT EXISTS idx_inventory_holds_expiry ON InventoryHolds(expires_at);
+
+-- Idempotency keys for POST /checkout/place
+CREATE TABLE IF NOT EXISTS CheckoutIdempotencyKeys (
+    user_id INT NOT NULL REFERENCES Users(id) ON DELETE CASCADE,
+    idempotency_key VARCHAR(64) NOT NULL,
+    order_id INT REFERENCES Orders(order_id) ON DELETE CASCADE,
+    created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL
+      DEFAULT (current_timestamp AT TIME ZONE 'UTC'),
+    CONSTRAINT checkout_idempotency_keys_unique UNIQUE (user_id, idempotency_key)
+);
+
+-- Append-only record of every change to Users.balance
+CREATE TABLE IF NOT EXISTS BalanceLedger (
+    entry_id SERIAL PRIMARY KEY,
+    user_id INT NOT NULL REFERENCES Users(id) ON DELETE CASCADE,
+    amount DECIMAL(12,2) NOT NULL,
+    kind VARCHAR(20) NOT NULL,
+    order_id INT REFERENCES Orders(order_id),
+    balance_after DECIMAL(12,2) NOT NULL,
+    created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL
+      DEFAULT (current_timestamp AT TIME ZONE 'UTC')
+);
+CREATE INDEX IF NOT EXISTS idx_balance_ledger_user ON BalanceLedger(user_id, entry_id);
+
+-- Async checkout queue (CHECKOUT_ASYNC), drained by order_worker.py
+CREATE TABLE IF NOT EXISTS OrderJobs (
+    job_id SERIAL PRIMARY KEY,
+    order_id INT NOT NULL UNIQUE REFERENCES Orders(order_id) ON DELETE CASCADE,
+    user_id INT NOT NULL REFERENCES Users(id),
+    cart_id INT NOT NULL REFERENCES Carts(cart_id),
+    inventory_ids INT[] NOT NULL,
+    quantities INT[] NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'queued',
+    attempts INT NOT NULL DEFAULT 0,
+    error TEXT,
+    created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL
+      DEFAULT (current_timestamp AT TIME ZONE 'UTC'),
+    finished_at TIMESTAMP WITHOUT TIME ZONE
+);
+CREATE INDEX IF NOT EXISTS idx_order_jobs_queued ON OrderJobs(job_id) WHERE status = 'queued';
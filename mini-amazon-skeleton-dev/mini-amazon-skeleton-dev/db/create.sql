@@ -1,4 +1,12 @@
+-- Trigram matching for typo-tolerant product search
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
 -- Clean start while developing (safe in dev; remove in prod)
+DROP TABLE IF EXISTS ProductStats CASCADE;
+DROP TABLE IF EXISTS InventoryHolds CASCADE;
+DROP TABLE IF EXISTS CheckoutIdempotencyKeys CASCADE;
+DROP TABLE IF EXISTS OrderJobs CASCADE;
+DROP TABLE IF EXISTS BalanceLedger CASCADE;
 DROP TABLE IF EXISTS OrderItems CASCADE;
 DROP TABLE IF EXISTS Orders CASCADE;
 DROP TABLE IF EXISTS CartItems CASCADE;
@@ -31,9 +39,19 @@ CREATE TABLE Products (
     seller_id INTEGER REFERENCES Users(id),
     available BOOLEAN DEFAULT TRUE,
     image VARCHAR(1024),
-    category VARCHAR(255)
+    category VARCHAR(255),
+    -- full-text search document (name > category > description); being a
+    -- generated column it is rewritten by every INSERT/UPDATE of the row
+    search_vector TSVECTOR GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', COALESCE(name, '')), 'A') ||
+        setweight(to_tsvector('english', COALESCE(category, '')), 'B') ||
+        setweight(to_tsvector('english', COALESCE(description, '')), 'C')
+    ) STORED
 );
 
+CREATE INDEX idx_products_search ON Products USING GIN (search_vector);
+CREATE INDEX idx_products_name_trgm ON Products USING GIN (name gin_trgm_ops);
+
 -- Purchases (sample/demo table from skeleton)
 CREATE TABLE Purchases (
     id INT NOT NULL PRIMARY KEY GENERATED BY DEFAULT AS IDENTITY,
@@ -76,7 +94,9 @@ CREATE TABLE CartItems (
     cart_item_id SERIAL PRIMARY KEY,
     cart_id INT NOT NULL REFERENCES Carts(cart_id),
     inventory_id INT NOT NULL REFERENCES Inventory(inventory_id),
-    quantity_required INT NOT NULL CHECK (quantity_required > 0)
+    quantity_required INT NOT NULL CHECK (quantity_required > 0),
+    -- one line per listing; adding it again bumps the quantity (Cart.add_item)
+    CONSTRAINT cart_items_unique UNIQUE (cart_id, inventory_id)
 );
 
 -- Orders
@@ -89,6 +109,79 @@ CREATE TABLE Orders (
       -- e.g., 'Pending', 'Successful', 'Failed', 'Partially Fulfilled', etc.
 );
 
+-- Inventory holds: stock set aside for a cart while its buyer is in checkout,
+-- then for the order an async checkout queued.
+-- A hold counts against availability until expires_at; expired rows are
+-- ignored by every query and deleted in bulk by the hold sweeper.
+CREATE TABLE InventoryHolds (
+    hold_id SERIAL PRIMARY KEY,
+    inventory_id INT NOT NULL REFERENCES Inventory(inventory_id) ON DELETE CASCADE,
+    cart_id INT NOT NULL REFERENCES Carts(cart_id) ON DELETE CASCADE,
+    -- NULL while the cart's checkout owns the hold; set once Order.enqueue
+    -- hands it to the queued order
+    order_id INT REFERENCES Orders(order_id) ON DELETE CASCADE,
+    quantity INT NOT NULL CHECK (quantity > 0),
+    expires_at TIMESTAMP WITHOUT TIME ZONE NOT NULL
+);
+-- one hold per item for a cart's live checkout, and one per item per order
+CREATE UNIQUE INDEX inventory_holds_one_per_cart ON InventoryHolds(inventory_id, cart_id) WHERE order_id IS NULL;
+CREATE UNIQUE INDEX inventory_holds_one_per_order ON InventoryHolds(order_id, inventory_id) WHERE order_id IS NOT NULL;
+-- held quantity per inventory row: an index-only range scan per cart line
+CREATE INDEX idx_inventory_holds_active ON InventoryHolds(inventory_id, expires_at) INCLUDE (cart_id, order_id, quantity);
+-- a cart's own holds: InventoryHold.place's up-to-date check and release
+CREATE INDEX idx_inventory_holds_cart ON InventoryHolds(cart_id);
+-- sweeper: DELETE ... WHERE expires_at <= now
+CREATE INDEX idx_inventory_holds_expiry ON InventoryHolds(expires_at);
+
+-- Idempotency keys for POST /checkout/place: a repeated submit of the same
+-- checkout form finds the order its first attempt created instead of placing
+-- a second one.  order_id is NULL only while the first attempt is running.
+CREATE TABLE CheckoutIdempotencyKeys (
+    user_id INT NOT NULL REFERENCES Users(id) ON DELETE CASCADE,
+    idempotency_key VARCHAR(64) NOT NULL,
+    order_id INT REFERENCES Orders(order_id) ON DELETE CASCADE,
+    created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL
+      DEFAULT (current_timestamp AT TIME ZONE 'UTC'),
+    CONSTRAINT checkout_idempotency_keys_unique UNIQUE (user_id, idempotency_key)
+);
+
+-- Append-only record of every change to Users.balance (kind: 'topup',
+-- 'withdrawal', 'order'); Users.balance is its running total, updated in the
+-- same statement as each entry
+CREATE TABLE BalanceLedger (
+    entry_id SERIAL PRIMARY KEY,
+    user_id INT NOT NULL REFERENCES Users(id) ON DELETE CASCADE,
+    amount DECIMAL(12,2) NOT NULL,
+    kind VARCHAR(20) NOT NULL,
+    order_id INT REFERENCES Orders(order_id),
+    balance_after DECIMAL(12,2) NOT NULL,
+    created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL
+      DEFAULT (current_timestamp AT TIME ZONE 'UTC')
+);
+-- balance history: a user's entries in order
+CREATE INDEX idx_balance_ledger_user ON BalanceLedger(user_id, entry_id);
+
+-- Async checkout queue (CHECKOUT_ASYNC): the cart lines of an order in
+-- status 'Queued', drained by order_worker.py with FOR UPDATE SKIP LOCKED.
+-- status: 'queued' -> 'done' | 'failed'
+CREATE TABLE OrderJobs (
+    job_id SERIAL PRIMARY KEY,
+    order_id INT NOT NULL UNIQUE REFERENCES Orders(order_id) ON DELETE CASCADE,
+    user_id INT NOT NULL REFERENCES Users(id),
+    cart_id INT NOT NULL REFERENCES Carts(cart_id),
+    inventory_ids INT[] NOT NULL,
+    quantities INT[] NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'queued',
+    -- tries that raised; the job fails for good at ORDER_JOB_MAX_ATTEMPTS
+    attempts INT NOT NULL DEFAULT 0,
+    error TEXT,
+    created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL
+      DEFAULT (current_timestamp AT TIME ZONE 'UTC'),
+    finished_at TIMESTAMP WITHOUT TIME ZONE
+);
+-- workers only ever look at the queued head of the table
+CREATE INDEX idx_order_jobs_queued ON OrderJobs(job_id) WHERE status = 'queued';
+
 -- Order Items
 CREATE TABLE OrderItems (
     order_item_id SERIAL PRIMARY KEY,
@@ -123,4 +216,21 @@ CREATE TABLE ProductReviews (
     created_at  TIMESTAMP WITHOUT TIME ZONE NOT NULL
                 DEFAULT (current_timestamp AT TIME ZONE 'UTC'),
     CONSTRAINT product_reviews_one_per_pair UNIQUE (product_id, user_id)
-);
\ No newline at end of file
+);
+
+-- Product Stats (precomputed browse/search aggregates, one row per product;
+-- maintained by the review and checkout paths, see app/models/product_stats.py)
+CREATE TABLE ProductStats (
+    product_id   INT NOT NULL PRIMARY KEY REFERENCES Products(product_id) ON DELETE CASCADE,
+    review_count INT NOT NULL DEFAULT 0,
+    rating_sum   INT NOT NULL DEFAULT 0,
+    avg_rating   DECIMAL(3,2) GENERATED ALWAYS AS
+                 (CASE WHEN review_count > 0 THEN ROUND(rating_sum::DECIMAL / review_count, 2) ELSE 0 END) STORED,
+    units_sold   INT NOT NULL DEFAULT 0
+);
+
+-- Browse keyset pagination: one (sort key, product_id) index per sort option
+CREATE INDEX idx_products_name_key ON Products(name, product_id);
+CREATE INDEX idx_products_price_key ON Products(price, product_id);
+CREATE INDEX idx_product_stats_rating_key ON ProductStats(avg_rating, product_id);
+CREATE INDEX idx_product_stats_sales_key ON ProductStats(units_sold, product_id);
@@ -16,4 +16,28 @@ SELECT pg_catalog.setval('public.purchases_id_seq',
 \COPY Wishes(uid, product_id, time_added) FROM '/home/ubuntu/shared/mini-amazon-skeleton/db/data/Wishes.csv' WITH DELIMITER ',' NULL '' CSV HEADER
 SELECT pg_catalog.setval('public.wishes_id_seq',
                          (SELECT MAX(id)+1 FROM Wishes),
-                         false);
\ No newline at end of file
+                         false);
+
+-- Seed ProductStats from the freshly loaded data
+-- (same query as ProductStats.rebuild() / rebuild_product_stats.py)
+INSERT INTO ProductStats (product_id, review_count, rating_sum, units_sold)
+SELECT p.product_id,
+       COALESCE(r.review_count, 0),
+       COALESCE(r.rating_sum, 0),
+       COALESCE(s.units_sold, 0)
+FROM Products p
+LEFT JOIN (
+    SELECT product_id, COUNT(*) AS review_count, SUM(rating) AS rating_sum
+    FROM ProductReviews
+    GROUP BY product_id
+) r ON r.product_id = p.product_id
+LEFT JOIN (
+    SELECT i.product_id, SUM(oi.quantity_required) AS units_sold
+    FROM OrderItems oi
+    JOIN Inventory i ON oi.inventory_id = i.inventory_id
+    GROUP BY i.product_id
+) s ON s.product_id = p.product_id
+ON CONFLICT (product_id)
+DO UPDATE SET review_count = EXCLUDED.review_count,
+              rating_sum = EXCLUDED.rating_sum,
+              units_sold = EXCLUDED.units_sold;
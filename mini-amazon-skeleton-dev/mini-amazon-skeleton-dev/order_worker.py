@@ -0,0 +1,52 @@
+# Place the orders queued by async checkout (CHECKOUT_ASYNC=1): each worker
+# process claims OrderJobs in batches with FOR UPDATE SKIP LOCKED, so any
+# number of them (on any number of hosts) can share the queue; a job that
+# keeps raising is failed after ORDER_JOB_MAX_ATTEMPTS tries
+# Run this with: python order_worker.py [--workers N] [--once]
+
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app import create_app
+from app.models.order import Order
+
+def run_worker(once=False):
+    app = create_app()
+    batch_size = app.config['ORDER_WORKER_BATCH_SIZE']
+    poll = app.config['ORDER_WORKER_POLL_SECONDS']
+    with app.app_context():
+        while True:
+            try:
+                handled = Order.process_jobs(batch_size)
+            except Exception:
+                app.logger.exception('order worker batch failed')
+                handled = 0
+            if handled:
+                app.logger.info('finished %d queued orders', handled)
+            elif once:
+                return
+            else:
+                time.sleep(poll)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--once', action='store_true', help='exit when the queue is empty')
+    args = parser.parse_args()
+
+    if args.workers <= 1:
+        run_worker(args.once)
+        return
+    workers = [multiprocessing.Process(target=run_worker, args=(args.once,), name=f'order-worker-{n}')
+               for n in range(args.workers)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+
+if __name__ == '__main__':
+    main()
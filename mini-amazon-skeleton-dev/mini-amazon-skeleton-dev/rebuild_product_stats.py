@@ -0,0 +1,19 @@
+# Recompute the ProductStats table from ProductReviews/OrderItems
+# (use after bulk loads or manual SQL edits that bypassed the app)
+# Run this with: python rebuild_product_stats.py
+
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app import create_app
+from app.models.product_stats import ProductStats
+
+def run_rebuild():
+    app = create_app()
+    with app.app_context():
+        count = ProductStats.rebuild()
+        print(f'✓ Rebuilt stats for {count} products')
+
+if __name__ == '__main__':
+    run_rebuild()